@@ -1,57 +1,95 @@
 #Prepare userland =========================================================
-from multiprocessing                        import Process, Pipe
+import time
+launch_time = time.perf_counter() # Start up is timed from here
+
+from multiprocessing                        import Process
 from PyQt5                                  import QtWidgets, QtCore, QtGui
 from pyqtgraph                              import PlotWidget, plot
-from numpy                                  import abs, where, ones
-import time
+from numpy                                  import ones, zeros, tile, arange, ceil
 import pyqtgraph                            as pg
 from backend                                import Backend
 from digital_signal_processing              import Processing
+from configuration                          import Configuration
+from trigger_control                        import TriggerControl
+from spectral_monitor                       import SpectralMonitor
 import sys  # We need sys so that we can pass argv to QApplication
 import os
-import serial #Crucial: Install using pip3 install "pyserial", NOT "serial"
-import serial.tools.list_ports
 
 class Frontend(QtWidgets.QMainWindow, Processing):
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, config=None, **kwargs):
 
-        bkn                 = Backend()
+        # Start up stages (ms after launch) until the first frame
+        self.startup_times  = {}
+        self.mark_startup('imports')
+
+        if config is None:
+            config          = Configuration()
+        self.config         = config
+        bkn                 = Backend(config)
 
         # Load parameters
         # -----------------------------------------------------------------
-        # self.port           = str(input("Which COM port is the arduino connected to?: "))
-        self.baud_rate      = 115200
-        self.numsamples     = int(bkn.sample_rate * bkn.buffer_length)
+        # config.serial_port  = str(input("Which COM port is the arduino connected to?: "))
         self.numchans       = bkn.num_channels
-        self.left_edge      = int(bkn.buffer_add)
         self.count          = 0
+        self.last_written   = 0
         self.s_down         = bkn.downsampling
-        self.idx_retain     = range(0, int(bkn.sample_rate * bkn.buffer_length), bkn.downsampling)
         self.yrange         = bkn.yrange
         self.maxvalue       = 2500
         self.last_trigger   = False
-        self.target_channel = 0
+        self.target_channel = config.target_channel
+
+        # Target channel is drawn at the bottom, further channels stacked
+        # above it, all in one curve
+        self.plot_channels  = [self.target_channel] + [iChan for iChan
+            in config.plot_channels if iChan != self.target_channel]
+        self.channel_offsets= arange(len(self.plot_channels))[:, None] * self.maxvalue
+
+        # Pipeline metrics of all processes (metrics.py)
+        self.metrics        = bkn.metrics
+        self.dsp_timer      = self.metrics.timer('dsp_ms')
+        self.render_timer   = self.metrics.timer('render_ms')
 
         # Load methods
         # -----------------------------------------------------------------
-        self.conn_socket    = bkn.prepare_socket(bkn.ip, bkn.port)
+        self.source         = bkn.prepare_source()
+        if config.output_dir is not None:
+            bkn.prepare_recorder(config.output_dir, config.subject_info)
 
-        # Generate variable exchange pipe
+        # Generate shared memory ring buffer the sampling process writes
+        # into and this process reads from
         # -----------------------------------------------------------------
-        self.recv_conn, self.send_conn = Pipe(duplex = False)
+        self.shared_buffer  = bkn.prepare_shared_buffer()
+        self.shared_beats, self.sensitivity = bkn.prepare_shared_beats()
+        self.last_beats     = 0
+        self.last_beat_time = None
 
         # Generate separate processes to not slow down sampling by any
         # other executions
         # -----------------------------------------------------------------
         self.sampling    = Process(target=bkn.fill_buffer,
-            args=(self.send_conn, self.conn_socket))
-        
-        self.sampling.start()
+            args=(self.source,))
+        self.stop_sampling  = bkn.stop
+        self.sampling_ready = bkn.ready_time
 
-        # Build GUI
+        # Trigger decisions and serial output run in their own process,
+        # this window only displays the trigger state
+        # -----------------------------------------------------------------
+        self.control        = TriggerControl(config, self.shared_buffer,
+            self.shared_beats, bkn.start_time, bkn.metrics)
+        self.controlling    = Process(target=self.control.run)
+        self.processes_started = False
+
+        # Build GUI while the filters are designed in the background
+        # (scipy is imported there). The processes are started once that
+        # is done (start_processes), so no thread is forked while
+        # importing. Under fork (GNU/Linux) they inherit scipy; under
+        # spawn (Windows, macOS) each one imports it again before it
+        # samples, reported as start up stage 'sampling ready'
         # -----------------------------------------------------------------
-        super(Frontend, self).__init__(*args, **kwargs)
+        super(Frontend, self).__init__(*args, config=config, prepare=False, **kwargs)
+        self.prepare_in_background(self.numchans, self.s_down)
 
         self.setWindowTitle("Detect heart beats")
         
@@ -70,8 +108,15 @@ class Frontend(QtWidgets.QMainWindow, Processing):
         widget_amp_threshold= QtWidgets.QWidget()
         amplayout           = QtWidgets.QVBoxLayout() # Horizontal Layout
 
-        init_value          = self.maxvalue*0.9
+        # In beats mode the slider sets the detector sensitivity, in
+        # amplitude mode the threshold on the signal itself
+        if config.trigger_mode == 'beats':
+            init_value      = self.maxvalue*config.sensitivity
+        else:
+            init_value      = self.maxvalue*0.9
         self.amp_title      = QtWidgets.QLabel(str(init_value))
+        self.rate_title     = QtWidgets.QLabel("-- bpm")
+        self.fps_title      = QtWidgets.QLabel("-- fps")
 
         ampSlider           = QtWidgets.QSlider(QtCore.Qt.Vertical)
         ampSlider.setTickPosition(QtWidgets.QSlider.TicksBothSides)
@@ -86,12 +131,36 @@ class Frontend(QtWidgets.QMainWindow, Processing):
 
         amplayout.addWidget(ampSlider)
         amplayout.addWidget(self.amp_title)
+        amplayout.addWidget(self.rate_title)
+        amplayout.addWidget(self.fps_title)
+
+        # Line noise frequency of the notch filter, switched while running
+        lineNoiseBox        = QtWidgets.QComboBox()
+        lineNoiseBox.addItems(["50 Hz", "60 Hz"])
+        lineNoiseBox.setCurrentIndex(int(config.line_noise == 60))
+        lineNoiseBox.currentIndexChanged.connect(self.line_noise_changed)
+        amplayout.addWidget(lineNoiseBox)
+
+        # Spectral view with signal quality, shown on demand
+        spectrumBox         = QtWidgets.QCheckBox("Spectrum")
+        amplayout.addWidget(spectrumBox)
         amplayout.addWidget(QtWidgets.QLabel("            ")) # This just assures width of the layout
         amplayout.geometry().width()
         widget_amp_threshold.setLayout(amplayout)
 
         self.graphWidget    = PlotWidget()
-        vertlayout.addWidget(self.graphWidget)
+        self.spectrumWidget = PlotWidget()
+        plotlayout          = QtWidgets.QVBoxLayout()
+        plotlayout.addWidget(self.graphWidget, 3)
+        plotlayout.addWidget(self.spectrumWidget, 1)
+        vertlayout.addLayout(plotlayout)
+
+        # Optional metrics overlay in the plot corner, refreshed with fps
+        self.metrics_panel  = QtWidgets.QLabel(self.graphWidget)
+        self.metrics_panel.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.metrics_panel.setStyleSheet("background-color: rgba(255, 245, 224, 200); padding: 4px")
+        self.metrics_panel.move(60, 10)
+        self.metrics_panel.setVisible(config.show_metrics)
         controlpanel.addWidget(widget_amp_threshold)
         vertlayout.addLayout(controlpanel)
 
@@ -99,12 +168,34 @@ class Frontend(QtWidgets.QMainWindow, Processing):
         self.setCentralWidget(self.central_widget)
         self.central_widget.setLayout(vertlayout) # Draw elements in main widget
 
-        # Real-time plotting
+        # Real-time plotting, paced at config.target_fps. Frames are only
+        # drawn when new samples arrived
+        self.frame_period   = 1 / config.target_fps # s
+        self.last_tick      = None
+        self.fps_start      = time.perf_counter()
+        self.fps_frames     = 0
+        self.measured_fps   = 0.0
+        self.dropped_frames = 0 # Ticks missed because a frame took too long
+
         self.timer = QtCore.QTimer()
-        self.timer.setInterval(0)
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.setInterval(int(round(1000 * self.frame_period)))
         self.timer.timeout.connect(self.update_plot_data)
         self.timer.singleShot = False
 
+        # Spectral view: raw samples read on its own timer at a low rate,
+        # never inside a trace frame. The interval grows if an update
+        # takes more than config.spectrum_budget of it
+        self.spectral_monitor   = SpectralMonitor(self.numchans, bkn.sample_rate,
+            config.line_noise, saturation_level=config.saturation_level)
+        self.spectrum_written   = 0
+        self.spectrum_period    = 1000 / config.spectrum_fps # ms
+        self.spectrum_timer     = QtCore.QTimer()
+        self.spectrum_timer.setInterval(int(round(self.spectrum_period)))
+        self.spectrum_timer.timeout.connect(self.update_spectrum)
+        self.spectrum_metric    = self.metrics.timer('spectrum_ms')
+        self.quality_gauge      = self.metrics.gauge('signal_quality')
+
         # Decorate
         self.graphWidget.setBackground('transparent')
         self.graphWidget.setYRange(self.yrange[0], self.yrange[1])
@@ -120,8 +211,37 @@ class Frontend(QtWidgets.QMainWindow, Processing):
         # Antialiasing decreases performance: Set False if too slow
         self.graphWidget.setAntialiasing(True)
 
-        # self.create_forward_port()
-        
+        # Fixed y range, threshold as a line that only moves with slider
+        self.graphWidget.setYRange(0, self.maxvalue * len(self.plot_channels))
+        self.graphWidget.setXRange(-bkn.buffer_length, 0, padding=0)
+        self.graphWidget.enableAutoRange(x=False)
+        self.threshold_line = pg.InfiniteLine(pos=self.yrange[1], angle=0, pen=pen2)
+        self.threshold_line.setVisible(config.trigger_mode == 'amplitude')
+        self.graphWidget.addItem(self.threshold_line)
+
+        # Shown until the first frame is plotted
+        self.status_text    = pg.TextItem("Waiting for stream...", color=(20, 30, 70), anchor=(0.5, 0.5))
+        self.status_text.setPos(-bkn.buffer_length / 2, self.maxvalue * len(self.plot_channels) / 2)
+        self.graphWidget.addItem(self.status_text)
+
+        # Spectra of the plotted channels (log power), quality as text
+        self.spectrumWidget.setBackground('transparent')
+        self.spectrumWidget.setLogMode(y=True)
+        self.spectrumWidget.setXRange(0, bkn.sample_rate / 2, padding=0)
+        self.spectrumWidget.setLabel('left', 'PSD (uV^2/Hz)')
+        self.spectrumWidget.setLabel('bottom', 'Frequency (Hz)')
+        self.spectrumWidget.setMouseEnabled(x=False, y=False)
+        self.spectrumWidget.hideButtons()
+        self.spectrum_lines = [self.spectrumWidget.plot(pen=pg.mkPen(color=(20, 30, 70)
+            if iPlot == 0 else (120, 130, 160), width=1)) for iPlot in range(len(self.plot_channels))]
+        self.quality_panel  = QtWidgets.QLabel(self.spectrumWidget)
+        self.quality_panel.setFont(QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+        self.quality_panel.setStyleSheet("background-color: rgba(255, 245, 224, 200); padding: 4px")
+        self.quality_panel.move(60, 5)
+        spectrumBox.toggled.connect(self.show_spectrum)
+        spectrumBox.setChecked(config.show_spectrum)
+        self.show_spectrum(config.show_spectrum)
+
         # Protect potentially breaking parts in safety net which will close
         # connections when errors are encountered
         try:
@@ -129,13 +249,21 @@ class Frontend(QtWidgets.QMainWindow, Processing):
             ampSlider.setValue(int(round(init_value)))
             ampSlider.setTickInterval(int(round(self.maxvalue/50)))
 
-            self.x = list(range(-self.numsamples, 0, self.s_down))
-            self.x = [x/bkn.sample_rate for x in self.x]
-            self.y = [0 for _ in range(0, self.numsamples, self.s_down)]
+            # Time axis relative to the newest sample (s), computed once
+            self.x = arange(-int(ceil(config.buffer_samples / self.s_down)), 0) * self.s_down / bkn.sample_rate
+            self.y = zeros(len(self.x))
+
+            # One stacked curve for all plotted channels: segments are
+            # not connected across channel boundaries
+            numpoints = len(self.x)
+            self.x_stacked = tile(self.x, len(self.plot_channels))
+            self.connect_channels = ones(numpoints * len(self.plot_channels), dtype=bool)
+            self.connect_channels[numpoints-1::numpoints] = False
 
             self.data_line = {}
-            self.data_line[0] =  self.graphWidget.plot(self.x, self.y, name='Heart', pen=pen1)
-            self.data_line[1] =  self.graphWidget.plot(self.x, self.y, name='Threshold', pen=pen2)
+            self.data_line[0] =  self.graphWidget.plot(self.x_stacked,
+                zeros(numpoints * len(self.plot_channels)),
+                connect=self.connect_channels, name='Heart', pen=pen1)
 
             # Disable interactivity
             self.graphWidget.setMouseEnabled(x=False, y=False)
@@ -145,9 +273,8 @@ class Frontend(QtWidgets.QMainWindow, Processing):
             self.graphWidget.mouseDragEvent = lambda *args, **kwargs: None
             self.graphWidget.hoverEvent = lambda *args, **kwargs: None
             
-            # self.sendser.open()
             self.timer.start()
-            print('Starting... Window may seem non-responsive for some seconds')
+            self.mark_startup('window')
 
         except:
             
@@ -160,89 +287,214 @@ class Frontend(QtWidgets.QMainWindow, Processing):
 
     def update_plot_data(self):
 
-        # Update plots for every channel
-        # -----------------------------------------------------------------
-        buffer, t_now       = self.recv_conn.recv()
+        self.measure_frame_rate()
+        self.mark_startup('event loop')
 
-        self.count = self.count + 1
+        # Update plots for every channel with all samples that arrived
+        # since last frame, once the filters are ready. Never wait for the
+        # sampling process or the filter design
+        # -----------------------------------------------------------------
+        if not self.streaming_ready.is_set():
+            return
+        if not self.processes_started:
+            self.start_processes()
+            return
+        total_written       = self.shared_buffer.total_written
+        if total_written:
+            self.mark_startup('first samples')
+        self.count          = total_written - self.last_written
         if self.count < self.s_down:
             return
+        self.last_written   = total_written
+        self.fps_frames     = self.fps_frames + 1
 
-        # Filter buffer signal and send filtered data to plotting funcs
-        # -------------------------------------------------------------
-        processed_buffer    = self.prepare_buffer(buffer,
-            self.b_notch, self.a_notch, self.b_workshop, self.a_workshop)
-        processed_buffer    = processed_buffer[:, self.left_edge:]
-
-        processed_buffer    = abs(processed_buffer)
-
-        self.x              = self.x[1:]  # Remove the first y element
-        self.x.append(self.x[-1]+self.count/self.sample_rate) # t_now/1000
-
-        self.y              = processed_buffer[self.target_channel, self.idx_retain]
-        self.data_line[0].setData(self.x, self.y)  # Update the data
-
-        # Plot threshold
-        self.data_line[1].setData(self.x, ones(len(self.x))*self.yrange[1])
-        # self.graphWidget.setYRange(self.yrange[0], self.yrange[1])
-        self.graphWidget.setYRange(0, self.maxvalue)
+        new_samples, time_stamps = self.shared_buffer.latest(self.count,
+            total_written=total_written)
+        t_now               = time_stamps[-1]
 
-        # Search for threshold crossing and send trigger if so
-        self.decide_trigger(self.y)
+        # Filter and decimate only the new samples and send the envelope
+        # of the decimated window (config.envelope_method) to plotting
+        # funcs
+        # -------------------------------------------------------------
+        t_dsp               = time.perf_counter()
+        processed_buffer, envelope_stamps = self.envelope_new_samples(
+            new_samples, time_stamps, self.plot_channels)
+        t_render            = time.perf_counter()
+        self.dsp_timer.observe((t_render - t_dsp) * 1000)
+
+        # Time axis from the (clock corrected) time stamps, relative to the
+        # newest sample
+        self.x              = (envelope_stamps - t_now) / 1000
+        self.x_stacked.reshape(len(self.plot_channels), -1)[:] = self.x
+
+        plotted             = processed_buffer
+        self.y              = plotted[0]
+        self.data_line[0].setData(self.x_stacked,
+            (plotted + self.channel_offsets).ravel(),
+            connect=self.connect_channels)  # Update the data
+        self.render_timer.observe((time.perf_counter() - t_render) * 1000)
+        if self.startup_times is not None:
+            self.report_startup()
+
+        # Display heart rate and trigger state of the control process
+        self.update_heart_rate()
+        self.show_trigger(bool(self.control.trigger_state.value))
 
         self.count          = 0
 
 
     def search_ports(self):
 
+        import serial.tools.list_ports #Crucial: Install using pip3 install "pyserial", NOT "serial"
         self.ports = list(serial.tools.list_ports.comports())
 
 
-    def create_forward_port(self):
-
-        self.sendser                = serial.Serial()
-        self.sendser.port           = self.port
-        self.sendser.baudrate       = self.baud_rate
-        self.sendser.timeout        = None
-        self.sendser.write_timeout  = None
-
-
-    def close_forward_port(self):
-
-        self.sendser.close()
-
-
-    def decide_trigger(self, signal):
-
-        above_thr           = where(signal >= self.yrange[1])[0]
-        below_thr           = where(signal < self.yrange[1])[0]
-
-        if below_thr.size == 0:
-            trigger         = True
-        elif above_thr.size == 0 or above_thr[-1] < below_thr[-1]:
-            trigger         = False
-        else:
-            trigger         = True            
+    def measure_frame_rate(self):
+
+        # Count timer ticks missed since the last one as dropped frames and
+        # report rendered frames per second once a second
+        now                 = time.perf_counter()
+        if self.last_tick is not None:
+            missed          = int(round((now - self.last_tick) / self.frame_period)) - 1
+            if missed > 0:
+                self.dropped_frames = self.dropped_frames + missed
+        self.last_tick      = now
+
+        if now - self.fps_start >= 1:
+            self.measured_fps   = self.fps_frames / (now - self.fps_start)
+            self.fps_start      = now
+            self.fps_frames     = 0
+            self.fps_title.setText("{:.0f} fps".format(self.measured_fps))
+            self.metrics.gauge('frame_rate').set(self.measured_fps)
+            self.metrics.gauge('frames_dropped').set(self.dropped_frames)
+            if self.metrics_panel.isVisible():
+                self.metrics_panel.setText(self.metrics.report())
+                self.metrics_panel.adjustSize()
+
+
+    def start_processes(self):
+        # Sampling and trigger processes, metrics export (its threads are
+        # not forked)
+        self.sampling.start()
+        self.controlling.start()
+        self.processes_started = True
+        self.metrics.start_export(self.config)
+        self.mark_startup('processes')
+
+
+    def mark_startup(self, stage):
+        # Time of the first occurence of stage (ms after launch)
+        if self.startup_times is not None and stage not in self.startup_times:
+            self.startup_times[stage] = (time.perf_counter() - launch_time) * 1000
+
+
+    def report_startup(self):
+        # =================================================================
+        # After the first frame: print the start up stages in order,
+        # publish the total as metric startup_ms and clear the waiting
+        # message
+        # =================================================================
+        self.mark_startup('first frame')
+        self.startup_times['filters'] = (self.prepared_time - launch_time) * 1000
+        if self.sampling_ready.value:
+            self.startup_times['sampling ready'] = (self.sampling_ready.value - launch_time) * 1000
+        stages              = sorted(self.startup_times.items(), key=lambda stage: stage[1])
+        print('Start up (ms after launch): ' + ', '.join('{} {:.0f}'.format(stage, t)
+            for stage, t in stages))
+        self.metrics.gauge('startup_ms').set(self.startup_times['first frame'])
+        self.status_text.setVisible(False)
+        self.startup_times  = None
+
+
+    def update_heart_rate(self):
+
+        # Collect beats published by the sampling process since last frame
+        total_beats         = self.shared_beats.total_written
+        if total_beats != self.last_beats:
+            beats, beat_times   = self.shared_beats.latest(
+                total_beats - self.last_beats, total_written=total_beats)
+            self.last_beats     = total_beats
+            self.last_beat_time = beat_times[-1]
+            if beats[0, -1] == beats[0, -1]: # Not NaN (first beat)
+                self.rate_title.setText("{:.0f} bpm".format(beats[0, -1]))
+
+
+    def show_trigger(self, trigger):
 
         if trigger != self.last_trigger:
             if trigger:
                 self.graphWidget.setBackground((255, 105, 105))
-                # self.sendser.write(bytes("H", 'utf-8'))
             else:
                 self.graphWidget.setBackground('transparent')
-                # self.sendser.write(bytes("L", 'utf-8'))
             self.setPalette(self.palette)
             self.last_trigger = trigger
 
 
     def value_changed(self, i):
-        self.yrange = [-i, i]
-        self.amp_title.setText(str(i))
+        self.set_threshold(i)
 
 
     def slider_position(self, i):
-        self.yrange = [-i, i]
-        self.amp_title.setText(str(i))
+        self.set_threshold(i)
+
+
+    def line_noise_changed(self, i):
+        frequency           = (50, 60)[i]
+        self.set_line_noise(frequency) # Display filter
+        self.control.line_noise.value = frequency # Trigger process filter
+        self.spectral_monitor.line_noise = frequency # Quality index
+
+
+    def show_spectrum(self, visible):
+        # Show or hide the spectral view, it only computes while shown
+        self.spectrumWidget.setVisible(visible)
+        if visible:
+            self.spectrum_written = self.shared_buffer.total_written
+            self.spectral_monitor.reset()
+            self.spectrum_timer.start()
+        else:
+            self.spectrum_timer.stop()
+
+
+    def update_spectrum(self):
+        # =================================================================
+        # Feed the raw samples since the last update to the running
+        # Welch PSD, redraw spectra and quality. Timed separately from
+        # the trace (spectrum_ms) and kept within config.spectrum_budget
+        # =================================================================
+        t_start             = time.perf_counter()
+        total_written       = self.shared_buffer.total_written
+        if total_written == self.spectrum_written:
+            return
+        samples, _          = self.shared_buffer.latest(total_written - self.spectrum_written,
+            total_written=total_written)
+        self.spectrum_written = total_written
+        if self.spectral_monitor.process(samples) == 0:
+            return
+
+        psd                 = self.spectral_monitor.psd
+        frequencies         = self.spectral_monitor.frequencies
+        for line, iChan in zip(self.spectrum_lines, self.plot_channels):
+            line.setData(frequencies[1:], psd[iChan, 1:] + 1e-12)
+        self.quality_panel.setText(self.spectral_monitor.report(self.plot_channels))
+        self.quality_panel.adjustSize()
+        self.quality_gauge.set(self.spectral_monitor.quality()['score'][self.target_channel])
+
+        duration            = (time.perf_counter() - t_start) * 1000
+        self.spectrum_metric.observe(duration)
+        self.spectrum_timer.setInterval(int(round(max(self.spectrum_period,
+            duration / self.config.spectrum_budget))))
+
+
+    def set_threshold(self, i):
+        if self.config.trigger_mode == 'beats':
+            self.sensitivity.value = i/self.maxvalue
+            self.amp_title.setText("{:.0f} %".format(100*i/self.maxvalue))
+        else:
+            self.yrange = [-i, i]
+            self.control.threshold.value = i
+            self.threshold_line.setValue(i)
+            self.amp_title.setText(str(i))
 
 
     def set_theme(self):
@@ -268,10 +520,19 @@ class Frontend(QtWidgets.QMainWindow, Processing):
 
     def on_closing(self):
         self.timer.stop()
-        self.sampling.terminate()
-        self.conn_socket.close()
-        self.recv_conn.close()
-        self.send_conn.close()
+        self.spectrum_timer.stop()
+        self.control.stop()
+        self.stop_sampling.set()
+        if self.processes_started:
+            self.controlling.join(timeout=2)
+            # Let the sampling process finish the recording (header with
+            # sample count and clock), terminate it only if stuck
+            self.sampling.join(timeout=2)
+            if self.sampling.is_alive():
+                self.sampling.terminate()
+        self.source.close()
+        self.shared_buffer.close()
+        self.shared_beats.close()
 
 
 if __name__ == '__main__': # Necessary line for "multiprocessing" to work
@@ -1,120 +1,269 @@
 import numpy as np
 import socket
-import json
 import time
 from threading import Thread
+from ring_buffer import RingBuffer, SharedRingBuffer
+from configuration import Configuration
+from beat_detection import BeatDetector
+from multiprocessing import RawValue, Event
+from recorder import SessionRecorder
+from sample_sources import UdpSource, ReplaySource, SyntheticSource
+from clock_sync import SampleClock
+from metrics import MetricsRegistry
 
 class Backend:
 
-    def __init__(self):
+    def __init__(self, config=None):
         # =================================================================
         # Initialize receiver
         # -----------------------------------------------------------------
         # - Connect to socket
-        # - Initialize zero buffer: self.buffer
-        # - Initialize time stamps array of zeros: self.time_stamps
+        # - Initialize zero ring buffer of samples and time stamps:
+        #   self.ring
+        # - Parameters are taken from config (see configuration.py)
         # =================================================================
+        if config is None:
+            config          = Configuration()
+        self.config         = config
 
         # Set streaming parameters
-        self.ip             = '127.0.0.1' # Localhost, requires Neuri GUI running
-        self.port           = 12344
-        self.sample_rate    = 200 # Hz
+        self.ip             = config.ip
+        self.port           = config.port
+        self.sample_rate    = config.sample_rate # Hz
 
         # Set buffer parameters
-        self.buffer_length  = 5 # s
-        self.buffer_add     = 4 # s
-        self.num_channels   = 2 # Neuri boards V1.0
-        self.downsampling   = 5 # Downsampling factor (int)
-        self.yrange         = [-200.0, +200.0] # float!
-
-        # Stop recording
-        self.stop           = False
+        self.buffer_length  = config.buffer_length # s
+        self.num_channels   = config.num_channels
+        self.downsampling   = config.downsampling # Downsampling factor (int)
+        self.yrange         = list(config.yrange) # float!
+
+        # Stop recording: set by stop_receiver or, across processes, by
+        # the frontend. fill_buffer checks it at least every source timeout
+        self.stop           = Event()
+
+        # perf_counter (s) once fill_buffer is prepared to receive, for the
+        # start up report of the frontend (0 until then)
+        self.ready_time     = RawValue('d', 0)
         
         # Initialize zeros buffer and time stamps
-        self.buffer         = self.prep_buffer(self.num_channels, self.buffer_length * self.sample_rate)
-        self.time_stamps    = self.prep_time_stamps(self.buffer_length)
-        self.start_time     = round(time.perf_counter() * 1000, 0)
+        self.ring           = RingBuffer(self.num_channels, config.buffer_samples)
+        self.start_time     = time.perf_counter() * 1000 # ms, as start_receiver
 
-        
-    def prep_buffer(self, num_channels, length):
-        # This functions creates the buffer structure
-        # that will be filled with eeg datasamples
-        return np.zeros((num_channels, length))
+        # Detect heart beats on the target channel as samples arrive.
+        # Beats are kept as [heart rate, latency] with the beat time as
+        # time stamp. The detector is designed where it runs, by
+        # fill_buffer (see prepare_beat_detector)
+        self.beat_detector  = None
+        self.beats          = RingBuffer(2, 64)
+        self.sensitivity    = RawValue('d', config.sensitivity)
 
+        # Raw stream is only recorded once prepare_recorder was called
+        self.recorder       = None
+
+        # Counters and timers shared with frontend and trigger process
+        self.metrics        = MetricsRegistry()
 
-    def prep_time_stamps(self, length):
-        return np.zeros(length)
-    
 
     def prepare_socket(self, ip, port):
         
         # Setup UDP protocol: connect to the UDP EEG streamer
         receiver_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         receiver_sock.bind((ip, int(port)))
+        self.receiver_sock  = receiver_sock
 
         return receiver_sock
 
 
-    def get_sample(self, readin_connection):
+    def prepare_source(self):
+        # =================================================================
+        # Create the sample source selected by config.source:
+        #   'udp'           Neuri GUI stream on config.ip:config.port
+        #   'replay'        Session in config.replay_path, in real time
+        #   'synthetic'     Generated ECG/EEG, in real time
+        # =================================================================
+        if self.config.source == 'udp':
+            return UdpSource(self.prepare_socket(self.ip, self.port), self.num_channels)
+        if self.config.source == 'replay':
+            source          = ReplaySource(self.config.replay_path)
+            num_channels    = len(source.header['channel_names'])
+            if num_channels != self.num_channels:
+                raise ValueError('Session {} has {} channels, configuration has {}'.format(
+                    self.config.replay_path, num_channels, self.num_channels))
+            return source
+        if self.config.source == 'synthetic':
+            return SyntheticSource(self.num_channels, self.sample_rate)
+        raise ValueError('Unknown sample source: ' + str(self.config.source))
 
-        valid_eeg = False
-        # Get eeg samples from the UDP streamer
-        raw_message, _  = readin_connection.recvfrom(1024)
 
-        try:
-            eeg_dict    = json.loads(raw_message)  # Vector with length self.num_channel
-            eeg_data    = np.array([float(eeg_dict["c1"]), float(eeg_dict["c2"])])
-            eeg_data    = np.expand_dims(eeg_data, 1)
-            valid_eeg   = True
-        except:
-            eeg_data    = np.array([0.0, 0.0])
-            print("Skipped message")
-        
-        return eeg_data, valid_eeg
+    def prepare_recorder(self, output_dir, subject_info):
+        # =================================================================
+        # Record the raw stream of fill_buffer to a new session directory
+        # in output_dir (see recorder.py). The writer starts with
+        # fill_buffer, in the process that receives
+        # =================================================================
+        self.recorder       = SessionRecorder(output_dir, subject_info,
+            self.sample_rate, self.config.channel_names)
+        return self.recorder
+
+
+    def prepare_shared_buffer(self):
+        # =================================================================
+        # Move the ring buffer to shared memory so that a frontend in
+        # another process can read it in place. Call before the sampling
+        # process is started
+        # =================================================================
+        self.ring           = SharedRingBuffer(self.num_channels, self.config.buffer_samples)
+        return self.ring
+
+
+    def prepare_shared_beats(self):
+        # =================================================================
+        # Share detected beats with the frontend the same way, and let it
+        # adjust the detector sensitivity through self.sensitivity
+        # =================================================================
+        self.beats          = SharedRingBuffer(2, 64)
+        return self.beats, self.sensitivity
+
+
+    def prepare_beat_detector(self):
+        # Design the detector filters (imports scipy, which takes a while)
+        if self.beat_detector is None:
+            self.beat_detector  = BeatDetector(self.sample_rate,
+                self.config.sensitivity, self.config.refractory)
+        return self.beat_detector
 
 
     def get_time_stamp(self):
         return round(time.perf_counter() * 1000 - self.start_time, 4)
 
 
-    def fill_buffer(self, sending_pipe, conn_socket):
-        # This functions fills the buffer in self.buffer
-        # that later can be accesed to perfom the real time analysis
-        
-        for _ in range(500):
-            emptying_message, _  = conn_socket.recvfrom(1024)
+    def fill_buffer(self, source):
+        # This functions fills the ring buffer in self.ring
+        # that later can be accesed to perfom the real time analysis.
+        # source is a sample source (sample_sources.py) or a bound UDP
+        # socket
+        if isinstance(source, socket.socket):
+            source          = UdpSource(source, self.num_channels)
+
+        # Slow preparations first: packets queued meanwhile are discarded
+        # by the warm up of source.start()
+        self.prepare_beat_detector()
+        self.ready_time.value = time.perf_counter()
+        source.start()
+
+        # Samples are stamped by a fit of sample index against arrival
+        # time instead of their arrival (see clock_sync.py)
+        self.clock          = SampleClock(self.sample_rate, self.config.clock_window)
+        lost_packets        = 0
+        last_status         = 0
+
+        packets_received    = self.metrics.counter('packets_received')
+        samples_received    = self.metrics.counter('samples_received')
+        loop_timer          = self.metrics.timer('sample_loop_ms')
 
-        while not self.stop:
-                
-            # Get samples
-            sample, valid       = self.get_sample(conn_socket)
-            time_stamp          = self.get_time_stamp()
+        if self.recorder is not None:
+            self.recorder.start()
 
-            if not valid:
-                continue
+        try:
+            while not self.stop.is_set() and not source.finished:
+                    
+                # Get samples (None if nothing arrived in time, so that
+                # self.stop is checked regularly)
+                samples             = source.read()
+                time_stamp          = self.get_time_stamp()
+
+                if samples is None:
+                    continue
+
+                # Lost packets (sequence gaps) are assumed to be as long
+                # as this one, so the clock keeps counting sample periods
+                num_lost            = 0
+                if getattr(source, 'lost_packets', 0) != lost_packets:
+                    num_lost        = (source.lost_packets - lost_packets) * samples.shape[1]
+                    lost_packets    = source.lost_packets
+                time_stamps         = self.clock.stamp(samples.shape[1], time_stamp, num_lost)
 
-            # Concatenate vector
-            update_buffer = np.concatenate((self.buffer, sample), axis=1)
+                # Write samples and time stamps in place (no reallocation).
+                # If the ring is shared, this also publishes it to the
+                # frontend
+                if samples.shape[1] == 1:
+                    self.ring.append(samples[:, 0], time_stamps[0])
+                else:
+                    self.ring.extend(samples, time_stamps)
 
-            # save to new buffer
-            self.buffer = update_buffer[:, 1:]
+                # Hand new samples to the recorder (never blocks)
+                if self.recorder is not None:
+                    self.recorder.write(samples, time_stamps)
 
-            # Save time_stamp
-            self.time_stamps = np.append(self.time_stamps, time_stamp)
-            self.time_stamps = self.time_stamps[1:]
+                # Detect beats in the new samples only
+                self.detect_beats(samples, time_stamps)
 
-            # Push to frontend
-            sending_pipe.send((self.buffer, time_stamp))
+                packets_received.increment()
+                samples_received.increment(samples.shape[1])
+                if time_stamp - last_status >= 1000:
+                    self.update_status(source)
+                    last_status     = time_stamp
+                loop_timer.observe(time.perf_counter() * 1000 - self.start_time - time_stamp)
 
-                
-        self.receiver_sock.close()
+        except OSError:
+            # Socket closed by stop_receiver while waiting for a packet
+            if not self.stop.is_set():
+                raise
+        finally:
+            if self.recorder is not None:
+                self.recorder.update_header(clock=self.clock.statistics())
+                self.recorder.stop()
+            print(self.clock_report())
+
+        source.close()
         return
 
 
+    def update_status(self, source):
+        # =================================================================
+        # Once a second: source and recorder state to the metrics, clock
+        # statistics to the session header
+        # =================================================================
+        statistics          = self.clock.statistics()
+        self.metrics.gauge('packets_skipped').set(getattr(source, 'skipped', 0))
+        self.metrics.gauge('packets_lost').set(getattr(source, 'lost_packets', 0))
+        self.metrics.gauge('clock_jitter_ms').set(statistics['jitter_ms'])
+        if self.recorder is not None:
+            self.metrics.gauge('recorder_queue_depth').set(self.recorder.pending.qsize())
+            self.metrics.gauge('recorder_overflows').set(self.recorder.overflows)
+            self.recorder.update_header(clock=statistics)
+
+
+    def clock_report(self):
+        # Text with the estimated sample rate, drift and jitter of the stream
+        return ('Clock: {sample_rate:.3f} Hz ({drift_ppm:+.0f} ppm), jitter '
+            '{jitter_ms:.2f} ms, {gaps} gaps, {bursts} bursts, {lost_samples} '
+            'lost samples'.format(**self.clock.statistics()))
+
+
+    def detect_beats(self, samples, time_stamps):
+        # =================================================================
+        # Input:
+        #   samples             Numpy array [channels x samples] just
+        #                       written to self.ring
+        #   time_stamps         Numpy 1D array [samples] of their time
+        #                       stamps (ms)
+        # =================================================================
+        self.beat_detector.sensitivity = self.sensitivity.value
+        for beat in self.beat_detector.process(
+            samples[self.config.target_channel], time_stamps):
+            self.beats.append(np.array([beat.heart_rate, beat.latency]),
+                beat.time_stamp)
+
+
     def start_receiver(self, output_dir, subject_info):
+        # Record to output_dir (None to not record)
+        if output_dir is not None:
+            self.prepare_recorder(output_dir, subject_info)
         # Define thread for receiving
         self.receiver_thread = Thread(
             target=self.fill_buffer,
+            args=(self.receiver_sock,),
             name='receiver_thread',
             daemon=False)
         # Set start time
@@ -123,8 +272,10 @@ class Backend:
         self.receiver_thread.start()
 
 
-    def stop_receiver(self, readin_connection):
-        # Change the status of self.stop to stop the recording
-        self.stop = True
+    def stop_receiver(self, readin_connection, timeout=2):
+        # Set self.stop to stop the recording. The receiving thread
+        # notices within the socket timeout: wait for it (recorder
+        # finalized) instead of a fixed time, then close
+        self.stop.set()
+        self.receiver_thread.join(timeout)
         readin_connection.close()
-        time.sleep(2)  # Wait two seconds to stop de recording to be sure that everything stopped
@@ -0,0 +1,156 @@
+import os
+import csv
+import time
+import argparse
+import numpy as np
+from concurrent.futures             import ProcessPoolExecutor
+from configuration                  import Configuration
+from digital_signal_processing      import Processing
+from beat_detection                 import BeatDetector
+from recorder                       import load_session
+
+
+SUMMARY_FIELDS = ['session', 'channel', 'num_samples', 'recording_length',
+    'num_beats', 'mean_heart_rate', 'std_heart_rate', 'min_heart_rate',
+    'max_heart_rate', 'processing_time']
+
+
+def analyse_channel(session_dir, channel, output_dir, session_name=None,
+    chunk_length=60, margin=1):
+    # =================================================================
+    # Worker: filter, envelope and beat detection of one channel
+    # -----------------------------------------------------------------
+    # Input:
+    #   session_dir         Session written by recorder.py, opened as
+    #                       memory map: only paths are sent to workers
+    #   channel             Channel index
+    #   output_dir          Results go to <output_dir>/<session>/c<N>_*
+    #   session_name        Name of the session in results (default:
+    #                       name of session_dir)
+    #   chunk_length        Samples are processed in chunks of this many
+    #                       seconds to bound memory
+    #   margin              Seconds of context on each side of a chunk
+    #                       for the (non-causal) Hilbert envelope
+    # Output:
+    #   row                 Dict of SUMMARY_FIELDS
+    # =================================================================
+    t_start             = time.perf_counter()
+    recording, time_stamps, header = load_session(session_dir)
+    signal              = recording[channel]
+    num_samples         = signal.shape[0]
+    sample_rate         = header['sample_rate']
+
+    config              = Configuration(sample_rate=sample_rate,
+        num_channels=recording.shape[0])
+    dsp                 = Processing(config)
+    stream_filter       = dsp.filter_bank.stream_filter()
+    detector            = BeatDetector(sample_rate, config.sensitivity, config.refractory)
+
+    if session_name is None:
+        session_name    = os.path.basename(os.path.normpath(session_dir))
+    result_dir          = os.path.join(output_dir, session_name)
+    os.makedirs(result_dir, exist_ok=True)
+    prefix              = os.path.join(result_dir, header['channel_names'][channel])
+    filtered            = np.lib.format.open_memmap(prefix + '_filtered.npy',
+        'w+', np.float32, (num_samples,))
+    envelope            = np.lib.format.open_memmap(prefix + '_envelope.npy',
+        'w+', np.float32, (num_samples,))
+
+    # Filtering and beat detection are causal and stateful: one pass
+    # -----------------------------------------------------------------
+    chunk               = max(1, int(chunk_length * sample_rate))
+    beats               = []
+    for start in range(0, num_samples, chunk):
+        samples         = np.asarray(signal[start:start + chunk], dtype=float)
+        filtered[start:start + chunk] = stream_filter.process(samples[None, :])[0]
+        beats.extend(detector.process(samples, time_stamps[start:start + chunk]))
+
+    # Envelope of the filtered signal, chunks overlap by margin
+    # -----------------------------------------------------------------
+    pad                 = int(margin * sample_rate)
+    for start in range(0, num_samples, chunk):
+        first           = max(0, start - pad)
+        last            = min(num_samples, start + chunk + pad)
+        chunk_envelope  = dsp.extract_envelope(np.asarray(filtered[first:last], dtype=float)[None, :])[0]
+        envelope[start:start + chunk] = chunk_envelope[start - first:start - first + chunk]
+    filtered.flush()
+    envelope.flush()
+
+    # Beat times and heart rate series
+    # -----------------------------------------------------------------
+    beat_table          = np.array([tuple(beat) for beat in beats]).reshape(-1, 3)
+    np.savetxt(prefix + '_beats.csv', beat_table, delimiter=',', fmt='%.3f',
+        header='time_stamp_ms,heart_rate_bpm,latency_ms', comments='')
+    rates               = beat_table[1:, 1]
+
+    return {
+        'session':          session_name,
+        'channel':          header['channel_names'][channel],
+        'num_samples':      num_samples,
+        'recording_length': num_samples / sample_rate,
+        'num_beats':        len(beats),
+        'mean_heart_rate':  rates.mean() if rates.size else np.nan,
+        'std_heart_rate':   rates.std() if rates.size else np.nan,
+        'min_heart_rate':   rates.min() if rates.size else np.nan,
+        'max_heart_rate':   rates.max() if rates.size else np.nan,
+        'processing_time':  time.perf_counter() - t_start}
+
+
+def run_batch(session_dirs, output_dir, workers=None, channels=None):
+    # =================================================================
+    # Input:
+    #   session_dirs        List of session directories
+    #   output_dir          Directory for per-channel results and the
+    #                       summary table summary.csv
+    #   workers             Number of worker processes (default: CPUs)
+    #   channels            Channel indices to analyse (default: all)
+    # Output:
+    #   rows                List of dicts, one per session and channel
+    # =================================================================
+    os.makedirs(output_dir, exist_ok=True)
+    # Sessions are named after their directory, or after parent and
+    # directory where names repeat (sessions started in the same second)
+    names               = [os.path.basename(os.path.normpath(session_dir))
+        for session_dir in session_dirs]
+    names               = [name if names.count(name) == 1 else
+        os.path.basename(os.path.dirname(os.path.normpath(session_dir))) + '_' + name
+        for name, session_dir in zip(names, session_dirs)]
+
+    jobs                = []
+    for session_dir, session_name in zip(session_dirs, names):
+        _, _, header    = load_session(session_dir)
+        session_channels= range(len(header['channel_names'])) if channels is None else channels
+        jobs.extend((header['num_samples'], session_dir, session_name, channel)
+            for channel in session_channels)
+
+    # Longest recordings first, so the pool does not end on one straggler
+    jobs.sort(key=lambda job: -job[0])
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures         = [executor.submit(analyse_channel, session_dir, channel,
+            output_dir, session_name) for _, session_dir, session_name, channel in jobs]
+        rows            = [future.result() for future in futures]
+
+    rows.sort(key=lambda row: (row['session'], row['channel']))
+    with open(os.path.join(output_dir, 'summary.csv'), 'w', newline='') as summary_file:
+        writer          = csv.DictWriter(summary_file, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+if __name__ == '__main__': # Necessary line for "multiprocessing" to work
+
+    parser = argparse.ArgumentParser(description='Analyse many recorded '
+        'sessions in parallel (filtered signals, envelopes, beats, heart rate)')
+    parser.add_argument('sessions', nargs='+', help='Session directories written by recorder.py')
+    parser.add_argument('--output', required=True, help='Directory for results')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPUs)')
+    parser.add_argument('--channels', type=int, nargs='+', default=None, help='Channel indices (default: all)')
+    args = parser.parse_args()
+
+    t_start = time.perf_counter()
+    rows    = run_batch(args.sessions, args.output, args.workers, args.channels)
+    print('{} channels of {} sessions in {:.1f} s, summary in {}'.format(len(rows),
+        len(args.sessions), time.perf_counter() - t_start,
+        os.path.join(args.output, 'summary.csv')))
@@ -0,0 +1,271 @@
+import sys
+import time
+from collections                    import namedtuple
+from numpy                          import arange, argmax, concatenate, cumsum, exp, flatnonzero, inf, isfinite, load, loadtxt, nan, zeros
+from digital_signal_processing      import StreamingFilter, design_filter
+
+
+# Detected heart beat
+#   time_stamp      Estimated time of the R-peak (ms, same clock as input)
+#   heart_rate      Instantaneous heart rate from the previous beat (bpm)
+#   latency         Time from R-peak to its detection (ms)
+Beat = namedtuple('Beat', ['time_stamp', 'heart_rate', 'latency'])
+
+
+class BeatDetector():
+
+    def __init__(self, sample_rate, sensitivity=0.75, refractory=0.25,
+        band=(5, 15), integration_window=0.15, learning_time=2, search_hold=0.05):
+        # =================================================================
+        # Streaming R-peak detector after Pan & Tompkins (1985)
+        # -----------------------------------------------------------------
+        # - Bandpass, derivative, squaring and moving window integration
+        #   keep their state between calls: every sample is processed
+        #   exactly once, with constant work per sample
+        # - Peaks of the integrated signal are beats if they exceed an
+        #   adaptive threshold between running signal (SPKI) and noise
+        #   (NPKI) peak levels and are outside the refractory period
+        # - The integrated signal ripples across the QRS: a peak above the
+        #   threshold is held until the integral falls below release_level
+        #   of it (its falling edge) or search_hold seconds passed, keeping
+        #   the largest peak meanwhile
+        # - The R-peak is the maximum of the bandpassed signal within the
+        #   integration window of that peak, corrected by the bandpass
+        #   delay. The whole QRS is in that window from the first peak on,
+        #   so an early release does not move the R-peak
+        # - Non-finite samples (NaN, inf) would stay in the filter states
+        #   for good: they are dropped and the filters restart after them
+        # - sensitivity in [0, 1] places the threshold: 0 at the signal
+        #   level, 1 at the noise level (0.75 is the original setting)
+        # - The first learning_time seconds only estimate SPKI and NPKI
+        # =================================================================
+        self.sample_rate    = sample_rate
+        self.sensitivity    = sensitivity
+        self.refractory     = int(round(refractory * sample_rate))
+        self.window         = max(1, int(round(integration_window * sample_rate)))
+        self.learning_length= int(learning_time * sample_rate)
+        self.hold           = max(1, int(round(search_hold * sample_rate)))
+        self.release_level  = 0.9 # Of the held peak
+
+        import scipy.signal
+        band                = (band[0], min(band[1], 0.45 * sample_rate))
+        sos, zi_unit        = design_filter('bandpass', band, 2, sample_rate)
+        self.bandpass       = StreamingFilter(sos, zi_unit)
+
+        # Delay of the bandpassed R-peak (samples): lag of the bandpass
+        # response maximum to an R wave of 15 ms half width. The group
+        # delay at band center overestimates it for pulses this short
+        pulse_time          = arange(int(sample_rate)) / sample_rate - 0.25
+        response            = scipy.signal.sosfilt(sos, exp(-(pulse_time / 0.015) ** 2))
+        self.delay          = argmax(response) - 0.25 * sample_rate
+
+        self.reset()
+
+
+    def reset(self):
+        self.restart()
+        self.num_processed  = 0
+        self.learning       = self.learning_length # Index where learning ends
+        self.learn_max      = 0.0
+        self.learn_sum      = 0.0
+        self.spki           = 0.0
+        self.npki           = 0.0
+        self.last_beat_idx  = -inf
+        self.last_beat_time = None
+
+
+    def restart(self):
+        # Filters and their histories start over, peak levels are kept
+        self.bandpass.reset()
+        self.filtered_tail  = zeros(4) # Derivative needs 4 past samples
+        self.squared_tail   = zeros(self.window - 1) # Integration window
+        self.mwi_tail       = zeros(2) # Peak search needs 2 past values
+        self.stamp_tail     = zeros(2)
+        # Bandpassed samples back to the integration window of a held peak
+        self.band_tail      = zeros(0)
+        self.band_stamp_tail= zeros(0)
+        self.pending        = None # Held peak: (index, value, first index)
+
+
+    def process(self, samples, time_stamps):
+        # =================================================================
+        # Input:
+        #   samples             Numpy 1D array [samples] of one channel,
+        #                       following the samples of last call
+        #   time_stamps         Numpy 1D array [samples] (ms)
+        # Output:
+        #   beats               List of Beat confirmed in this call
+        # =================================================================
+        finite              = isfinite(samples)
+        if not finite.all():
+            num_dropped     = flatnonzero(~finite)[-1] + 1
+            self.restart()
+            if self.num_processed < self.learning:
+                # Learning starts over after the dropped samples
+                self.learning   = self.num_processed + num_dropped + self.learning_length
+                self.learn_max  = 0.0
+                self.learn_sum  = 0.0
+            self.num_processed  = self.num_processed + num_dropped
+            samples         = samples[num_dropped:]
+            time_stamps     = time_stamps[num_dropped:]
+
+        num_new             = samples.shape[0]
+        if num_new == 0:
+            return []
+
+        # Bandpass and five-point derivative
+        # -----------------------------------------------------------------
+        filtered            = self.bandpass.process(samples[None, :])[0]
+        extended            = concatenate((self.filtered_tail, filtered))
+        derivative          = (2 * extended[4:] + extended[3:-1]
+            - extended[1:-3] - 2 * extended[:-4]) / 8
+        self.filtered_tail  = extended[-4:]
+
+        # Squaring and moving window integration
+        # -----------------------------------------------------------------
+        squared             = concatenate((self.squared_tail, derivative ** 2))
+        running_sum         = cumsum(concatenate(([0.0], squared)))
+        integrated          = (running_sum[self.window:] - running_sum[:-self.window]) / self.window
+        self.squared_tail   = squared[len(squared) - self.window + 1:]
+
+        # Learning phase: initial signal and noise peak levels
+        # -----------------------------------------------------------------
+        if self.num_processed < self.learning:
+            learning        = integrated[:self.learning - self.num_processed]
+            self.learn_max  = max(self.learn_max, learning.max())
+            self.learn_sum  = self.learn_sum + learning.sum()
+            if self.num_processed + num_new >= self.learning:
+                self.spki   = 0.25 * self.learn_max
+                self.npki   = 0.5 * self.learn_sum / self.learning_length
+
+        # Local maxima of the integrated signal (confirmed by the next
+        # sample), then the adaptive threshold logic per candidate only
+        # -----------------------------------------------------------------
+        values              = concatenate((self.mwi_tail, integrated))
+        stamps              = concatenate((self.stamp_tail, time_stamps))
+        candidates          = flatnonzero((values[1:-1] > values[:-2]) &
+            (values[1:-1] >= values[2:])) + 1
+        first_idx           = self.num_processed - 2 # Global index of values[0]
+
+        band                = concatenate((self.band_tail, filtered))
+        band_stamps         = concatenate((self.band_stamp_tail, time_stamps))
+        band_idx            = self.num_processed - self.band_tail.shape[0] # Of band[0]
+
+        beats               = []
+        for iPeak in candidates:
+            beats.extend(self.release(values, stamps, first_idx, iPeak,
+                band, band_stamps, band_idx))
+            peak_idx        = first_idx + iPeak
+            if peak_idx < self.learning or peak_idx - self.last_beat_idx < self.refractory:
+                continue
+
+            # Ripple of the held QRS: keep the largest peak
+            value           = values[iPeak]
+            if self.pending is not None:
+                if value > self.pending[1]:
+                    self.pending = (peak_idx, value, self.pending[2])
+                continue
+
+            threshold       = self.npki + (1 - self.sensitivity) * (self.spki - self.npki)
+            if value <= threshold:
+                self.npki   = 0.125 * value + 0.875 * self.npki
+                continue
+            self.pending    = (peak_idx, value, peak_idx)
+        beats.extend(self.release(values, stamps, first_idx, values.shape[0],
+            band, band_stamps, band_idx))
+
+        keep                = min(band.shape[0], self.hold + self.window + 2)
+        self.band_tail      = band[band.shape[0] - keep:]
+        self.band_stamp_tail= band_stamps[band.shape[0] - keep:]
+        self.mwi_tail       = values[-2:]
+        self.stamp_tail     = stamps[-2:]
+        self.num_processed  = self.num_processed + num_new
+        return beats
+
+
+    def release(self, values, stamps, first_idx, end, band, band_stamps, band_idx):
+        # =================================================================
+        # Confirm the held peak if the integral fell below release_level
+        # of it or the hold passed before values[end]
+        # -----------------------------------------------------------------
+        # Input:
+        #   values, stamps      Integrated signal and time stamps of this
+        #                       call, values[0] at global index first_idx
+        #   end                 Local index up to which samples are known
+        #   band, band_stamps   Bandpassed signal and time stamps,
+        #                       band[0] at global index band_idx
+        # Output:
+        #   beats               List of the confirmed Beat, if any
+        # =================================================================
+        if self.pending is None:
+            return []
+        peak_idx, value, start_idx = self.pending
+
+        begin               = max(peak_idx - first_idx + 1, 0)
+        fallen              = flatnonzero(values[begin:end] < self.release_level * value)
+        release             = start_idx + self.hold - first_idx
+        if fallen.shape[0] > 0:
+            release         = min(release, begin + fallen[0])
+        if release >= end:
+            return []
+        self.pending        = None
+        self.spki           = 0.125 * value + 0.875 * self.spki
+
+        # R-peak: bandpassed maximum within the integration window (the
+        # derivative centers g - window - 1 to g - 2 of integral sample g)
+        low                 = max(peak_idx - self.window - 1 - band_idx, 0)
+        high                = peak_idx - 1 - band_idx
+        iR                  = low + argmax(band[low:high])
+        beat_time           = band_stamps[iR] - self.delay * 1000 / self.sample_rate
+        if self.last_beat_time is None:
+            heart_rate      = nan
+        else:
+            heart_rate      = 60000 / (beat_time - self.last_beat_time)
+        self.last_beat_idx  = peak_idx
+        self.last_beat_time = beat_time
+        return [Beat(beat_time, heart_rate, stamps[max(release, 0)] - beat_time)]
+
+
+def evaluate_offline(signal, sample_rate, chunk_size=1000, **detector_args):
+    # =================================================================
+    # Replay a recorded channel through the detector as fast as possible
+    # -----------------------------------------------------------------
+    # Input:
+    #   signal              Numpy 1D array [samples]
+    #   sample_rate         Sampling rate of the recording (Hz)
+    #   chunk_size          Samples handed to the detector per call
+    # Output:
+    #   beats               List of Beat
+    #   throughput          Processed samples/s
+    # =================================================================
+    detector            = BeatDetector(sample_rate, **detector_args)
+    time_stamps         = arange(signal.shape[0]) * 1000 / sample_rate
+    beats               = []
+
+    t_start             = time.perf_counter()
+    for start in range(0, signal.shape[0], chunk_size):
+        beats.extend(detector.process(signal[start:start + chunk_size],
+            time_stamps[start:start + chunk_size]))
+    duration            = time.perf_counter() - t_start
+
+    return beats, signal.shape[0] / duration
+
+
+if __name__ == '__main__':
+    # Usage: python beat_detection.py <recording .npy/.txt> <sample rate>
+    #   [channel]. Recordings are [samples] or [channels x samples]
+    file_name           = sys.argv[1]
+    sample_rate         = float(sys.argv[2])
+    channel             = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    recording           = load(file_name) if file_name.endswith('.npy') else loadtxt(file_name)
+    if recording.ndim > 1:
+        recording       = recording[channel]
+
+    beats, throughput   = evaluate_offline(recording, sample_rate)
+    rates               = [beat.heart_rate for beat in beats[1:]]
+    print('{} beats in {:.1f} s'.format(len(beats), recording.shape[0] / sample_rate))
+    if rates:
+        print('Mean heart rate {:.1f} bpm'.format(sum(rates) / len(rates)))
+    print('Throughput {:,.0f} samples/s ({:,.0f}x real time)'.format(
+        throughput, throughput / sample_rate))
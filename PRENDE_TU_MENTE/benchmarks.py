@@ -0,0 +1,700 @@
+import os
+import sys
+import time
+import json
+import socket
+import argparse
+import subprocess
+import platform
+import tempfile
+import numpy as np
+import scipy.signal
+from ring_buffer                    import RingBuffer
+from wire_format                    import encode_binary_packet, decode_packet
+from sample_sources                 import UdpSource
+from digital_signal_processing      import Processing, StreamingDecimator, StreamingEnvelope
+from sample_sources                 import SyntheticSource
+from recorder                       import SessionRecorder
+from batch_analysis                 import run_batch
+from backend                        import Backend
+from configuration                  import Configuration
+from metrics                        import MetricsRegistry
+from spectral_monitor               import SpectralMonitor
+
+
+# =====================================================================
+# Benchmarks of the real-time hot paths on synthetic data
+# ---------------------------------------------------------------------
+#   python benchmarks.py                        Run the suite, print it
+#   python benchmarks.py --output base.json     Also save the results
+#   python benchmarks.py --baseline base.json   Compare against saved
+#                                               results, exit code 1 if
+#                                               anything got slower by
+#                                               more than --tolerance
+#   python benchmarks.py --only dsp render      Run some groups only
+# Every result is the median of --repeat runs with fixed random seeds
+# =====================================================================
+
+def benchmark_buffer_update(sample_rate, num_channels=2, buffer_length=5, duration=10):
+    # =================================================================
+    # Input:
+    #   sample_rate         Simulated sampling rate (Hz)
+    #   num_channels        Number of channels per sample
+    #   buffer_length       Buffer length (s)
+    #   duration            Simulated stream length (s)
+    # Output:
+    #   results             Dict of samples/s for the former
+    #                       concatenate/append update and the ring buffer
+    # =================================================================
+    num_buffer          = int(buffer_length * sample_rate)
+    num_samples         = int(duration * sample_rate)
+    samples             = np.random.randn(num_channels, num_samples)
+    time_stamps         = np.arange(num_samples) / sample_rate
+
+    # Former Backend.fill_buffer: copy whole buffer for every sample
+    # -----------------------------------------------------------------
+    buffer              = np.zeros((num_channels, num_buffer))
+    stamps              = np.zeros(num_buffer)
+    t_start             = time.perf_counter()
+    for iSample in range(num_samples):
+        update_buffer   = np.concatenate((buffer, samples[:, iSample:iSample+1]), axis=1)
+        buffer          = update_buffer[:, 1:]
+        stamps          = np.append(stamps, time_stamps[iSample])
+        stamps          = stamps[1:]
+    t_legacy            = time.perf_counter() - t_start
+
+    # Ring buffer: in-place writes
+    # -----------------------------------------------------------------
+    ring                = RingBuffer(num_channels, num_buffer)
+    t_start             = time.perf_counter()
+    for iSample in range(num_samples):
+        ring.append(samples[:, iSample], time_stamps[iSample])
+    t_ring              = time.perf_counter() - t_start
+
+    return {'legacy': num_samples / t_legacy, 'ring': num_samples / t_ring}
+
+
+def benchmark_decode(num_channels=2, samples_per_packet=20, num_packets=20000):
+    # =================================================================
+    # Output:
+    #   results             Dict of decoded samples/s for one-sample JSON
+    #                       packets and batched binary packets
+    # =================================================================
+    json_packet         = json.dumps({"c" + str(iChan + 1): 12.5
+        for iChan in range(num_channels)}).encode()
+    binary_packet       = encode_binary_packet(
+        np.random.randn(num_channels, samples_per_packet), 0)
+
+    t_start             = time.perf_counter()
+    for _ in range(num_packets):
+        decode_packet(json_packet, len(json_packet), num_channels)
+    t_json              = time.perf_counter() - t_start
+
+    t_start             = time.perf_counter()
+    for _ in range(num_packets):
+        decode_packet(binary_packet, len(binary_packet), num_channels)
+    t_binary            = time.perf_counter() - t_start
+
+    return {'json': num_packets / t_json,
+        'binary': num_packets * samples_per_packet / t_binary}
+
+
+def benchmark_frame_filtering(num_channels=2, new_per_frame=5, num_frames=2000):
+    # =================================================================
+    # Output:
+    #   results             Dict of frames/s for re-filtering the whole
+    #                       window and for streaming filtering of the
+    #                       new samples only
+    # =================================================================
+    dsp                 = Processing()
+    dsp.prepare_streaming(num_channels)
+    window              = np.random.randn(num_channels, dsp.buffer_length)
+    new_samples         = np.random.randn(num_channels, new_per_frame)
+    time_stamps         = np.zeros(new_per_frame)
+
+    t_start             = time.perf_counter()
+    for _ in range(num_frames):
+        dsp.prepare_buffer(window, dsp.b_notch, dsp.a_notch,
+            dsp.b_workshop, dsp.a_workshop)
+    t_window            = time.perf_counter() - t_start
+
+    t_start             = time.perf_counter()
+    for _ in range(num_frames):
+        dsp.filter_new_samples(new_samples, time_stamps)
+    t_stream            = time.perf_counter() - t_start
+
+    return {'window': num_frames / t_window, 'streaming': num_frames / t_stream}
+
+
+def benchmark_channel_scaling(num_channels, window=1000, s_down=5, num_frames=200):
+    # =================================================================
+    # Input:
+    #   num_channels        Number of channels of the montage
+    # Output:
+    #   results             Dict of frames/s for filtering, decimating
+    #                       and Hilbert-transforming channel by channel
+    #                       and for the vectorized calls
+    # =================================================================
+    dsp                 = Processing()
+    buffer              = np.random.randn(num_channels, window)
+
+    t_start             = time.perf_counter()
+    for _ in range(num_frames):
+        for iChan in range(num_channels):
+            channel     = dsp.filter_signal(buffer[iChan,], dsp.b_notch, dsp.a_notch)
+            channel     = dsp.filter_signal(channel, dsp.b_workshop, dsp.a_workshop)
+            channel     = channel[::s_down]
+            abs(scipy.signal.hilbert(channel))
+    t_loop              = time.perf_counter() - t_start
+
+    t_start             = time.perf_counter()
+    for _ in range(num_frames):
+        filtered        = dsp.prepare_buffer(buffer, dsp.b_notch, dsp.a_notch,
+            dsp.b_workshop, dsp.a_workshop)
+        dsp.extract_envelope(dsp.downsample(filtered, s_down))
+    t_vector            = time.perf_counter() - t_start
+
+    return {'loop': num_frames / t_loop, 'vectorized': num_frames / t_vector}
+
+
+def make_synthetic_sessions(directory, num_sessions, duration, num_channels=2, sample_rate=200):
+    # =================================================================
+    # Write num_sessions recordings of duration seconds of synthetic
+    # data with recorder.py, return their session directories
+    # =================================================================
+    session_dirs        = []
+    for iSession in range(num_sessions):
+        source          = SyntheticSource(num_channels, sample_rate, real_time=False,
+            chunk_size=60 * sample_rate, duration=duration, seed=iSession)
+        recorder        = SessionRecorder(os.path.join(directory, str(iSession)), {},
+            sample_rate, ['c' + str(iChan + 1) for iChan in range(num_channels)])
+        recorder.start()
+        source.start()
+        while not source.finished:
+            samples     = source.read()
+            start       = source.num_read - samples.shape[1]
+            recorder.write(samples, (start + np.arange(samples.shape[1])) * 1000 / sample_rate)
+        recorder.stop()
+        session_dirs.append(recorder.session_dir)
+    return session_dirs
+
+
+def benchmark_batch_scaling(max_workers=None, num_sessions=8, duration=600):
+    # =================================================================
+    # Output:
+    #   results             Dict of worker count to (wall time s, speedup,
+    #                       parallel efficiency) of batch_analysis.py
+    # =================================================================
+    max_workers         = max_workers or os.cpu_count()
+    results             = {}
+    with tempfile.TemporaryDirectory() as directory:
+        session_dirs    = make_synthetic_sessions(os.path.join(directory, 'sessions'),
+            num_sessions, duration)
+        for workers in range(1, max_workers + 1):
+            t_start     = time.perf_counter()
+            run_batch(session_dirs, os.path.join(directory, 'results'), workers)
+            wall_time   = time.perf_counter() - t_start
+            speedup     = results[1][0] / wall_time if results else 1.0
+            results[workers] = (wall_time, speedup, speedup / workers)
+    return results
+
+
+def benchmark_startup_imports():
+    # =================================================================
+    # Output:
+    #   results             Dict of s to import the frontend module and
+    #                       scipy.signal (imported later, in the
+    #                       background) in a fresh interpreter
+    # =================================================================
+    results             = {}
+    for name, module in (('frontend', 'PRENDE_TU_MENTE'), ('scipy_signal', 'scipy.signal')):
+        t_start         = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import ' + module], check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=dict(os.environ, QT_QPA_PLATFORM='offscreen'))
+        results[name]   = time.perf_counter() - t_start
+    return results
+
+
+def benchmark_metrics_overhead(num_reads=20000):
+    # =================================================================
+    # Output:
+    #   results             Dict of time per read (us) of the sample loop
+    #                       (Backend.fill_buffer, one sample per read)
+    #                       and of its instrumentation alone, and their
+    #                       ratio
+    # =================================================================
+    config              = Configuration()
+    backend             = Backend(config)
+    source              = SyntheticSource(config.num_channels, config.sample_rate,
+        real_time=False, chunk_size=1, duration=num_reads / config.sample_rate)
+    t_start             = time.perf_counter()
+    backend.fill_buffer(source)
+    t_loop              = (time.perf_counter() - t_start) / num_reads
+
+    # Same updates as fill_buffer does per read (the arrival time stamp
+    # is taken anyway)
+    metrics             = MetricsRegistry()
+    packets             = metrics.counter('packets_received')
+    samples             = metrics.counter('samples_received')
+    loop_timer          = metrics.timer('sample_loop_ms')
+    time_stamp          = backend.get_time_stamp()
+    last_status         = time_stamp
+    t_start             = time.perf_counter()
+    for _ in range(num_reads):
+        packets.increment()
+        samples.increment(1)
+        if time_stamp - last_status >= 1000:
+            last_status = time_stamp
+        loop_timer.observe(time.perf_counter() * 1000 - backend.start_time - time_stamp)
+    t_metrics           = (time.perf_counter() - t_start) / num_reads
+
+    return {'loop': t_loop * 1e6, 'metrics': t_metrics * 1e6,
+        'overhead': t_metrics / t_loop}
+
+
+def benchmark_udp_loopback(packet_format, num_channels=2, samples_per_packet=20,
+    num_packets=20000, burst=100):
+    # =================================================================
+    # Input:
+    #   packet_format       'json' (one sample per packet) or 'binary'
+    # Output:
+    #   results             Dict of samples/s received and decoded by
+    #                       UdpSource from a loopback sender
+    # -----------------------------------------------------------------
+    # Sender and receiver alternate in bursts that fit the socket
+    # buffer, so that the result does not depend on thread scheduling
+    # =================================================================
+    receiver            = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 2**20)
+    receiver.bind(('127.0.0.1', 0))
+    sender              = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address             = receiver.getsockname()
+
+    rng                 = np.random.default_rng(0)
+    samples             = rng.standard_normal((num_channels, samples_per_packet))
+    json_packet         = json.dumps({"c" + str(iChan + 1): float(samples[iChan, 0])
+        for iChan in range(num_channels)}).encode()
+
+    source              = UdpSource(receiver, num_channels, warm_up_packets=0)
+    source.start()
+    num_samples         = 0
+    t_receive           = 0.0
+    for iBurst in range(num_packets // burst):
+        for iPacket in range(burst):
+            if packet_format == 'json':
+                sender.sendto(json_packet, address)
+            else: # Binary packets are numbered, or count as duplicates
+                sender.sendto(encode_binary_packet(samples, iBurst * burst + iPacket), address)
+        t_start         = time.perf_counter()
+        for _ in range(burst):
+            num_samples = num_samples + source.read().shape[1]
+        t_receive       = t_receive + time.perf_counter() - t_start
+    source.close()
+    sender.close()
+    return {'samples_per_s': num_samples / t_receive}
+
+
+def benchmark_frame_dsp(num_channels, buffer_length, new_per_frame=7, num_frames=500):
+    # =================================================================
+    # Input:
+    #   num_channels        Number of channels
+    #   buffer_length       Window length (s) at 200 Hz
+    # Output:
+    #   results             Dict of ms per frame of the frontend DSP
+    #                       (streaming filter and decimation of the new
+    #                       samples, rectification of the decimated
+    #                       window)
+    # =================================================================
+    config              = Configuration(num_channels=num_channels,
+        buffer_length=buffer_length, plot_channels=list(range(num_channels)))
+    dsp                 = Processing(config)
+    dsp.prepare_streaming(num_channels, config.downsampling)
+    rng                 = np.random.default_rng(0)
+    new_samples         = rng.standard_normal((num_channels, new_per_frame))
+    time_stamps         = np.zeros(new_per_frame)
+
+    t_start             = time.perf_counter()
+    for _ in range(num_frames):
+        processed       = dsp.filter_new_samples(new_samples, time_stamps)
+        abs(processed[config.plot_channels])
+    return {'ms_per_frame': (time.perf_counter() - t_start) / num_frames * 1000}
+
+
+def benchmark_decimation(num_channels, factor, new_per_frame=7, num_frames=2000):
+    # =================================================================
+    # Output:
+    #   results             Dict of ms per frame for the streaming
+    #                       decimator (new samples only) and for
+    #                       decimating the whole 5 s window per frame
+    # =================================================================
+    dsp                 = Processing()
+    decimator           = StreamingDecimator(factor, dsp.sample_rate)
+    rng                 = np.random.default_rng(0)
+    new_samples         = rng.standard_normal((num_channels, new_per_frame))
+    time_stamps         = np.zeros(new_per_frame)
+    window              = rng.standard_normal((num_channels, dsp.buffer_length))
+
+    t_start             = time.perf_counter()
+    for _ in range(num_frames):
+        decimator.process(new_samples, time_stamps)
+    t_stream            = time.perf_counter() - t_start
+
+    t_start             = time.perf_counter()
+    for _ in range(num_frames // 10):
+        dsp.downsample(window, factor)
+    t_window            = time.perf_counter() - t_start
+
+    return {'streaming': t_stream / num_frames * 1000,
+        'window': t_window / (num_frames // 10) * 1000}
+
+
+def decimation_alias_rejection(factor, sample_rate=200, num_tones=40, duration=20):
+    # =================================================================
+    # Tones from the output Nyquist frequency to the input Nyquist
+    # frequency through the streaming decimator
+    # -----------------------------------------------------------------
+    # Output:
+    #   rejection           Lowest attenuation (dB) of a tone: how far
+    #                       the worst aliased frequency stays below the
+    #                       output band
+    # =================================================================
+    output_nyquist      = sample_rate / factor / 2
+    tones               = np.linspace(output_nyquist, sample_rate / 2, num_tones, endpoint=False)
+    t                   = np.arange(int(duration * sample_rate)) / sample_rate
+    signal              = np.cos(2 * np.pi * tones[:, None] * t)
+    decimator           = StreamingDecimator(factor, sample_rate)
+    decimated, _        = decimator.process(signal)
+    settled             = decimated[:, int(2 * decimator.delay / factor) + 1:] # Past the filter start
+    amplitude           = np.sqrt(2 * np.mean(settled ** 2, axis=1))
+    return float(-20 * np.log10(amplitude.max()))
+
+
+def benchmark_envelope(num_channels, method, new_per_frame=7, num_frames=500):
+    # =================================================================
+    # Output:
+    #   results             Dict of ms per frame of the frontend DSP
+    #                       with envelope method ('rectified', 'fft',
+    #                       'hilbert' or 'lowpass', see configuration.py)
+    # =================================================================
+    config              = Configuration(num_channels=num_channels,
+        plot_channels=list(range(num_channels)), envelope_method=method)
+    dsp                 = Processing(config)
+    dsp.prepare_streaming(num_channels, config.downsampling)
+    rng                 = np.random.default_rng(0)
+    new_samples         = rng.standard_normal((num_channels, new_per_frame))
+    time_stamps         = np.zeros(new_per_frame)
+
+    t_start             = time.perf_counter()
+    for _ in range(num_frames):
+        dsp.envelope_new_samples(new_samples, time_stamps, config.plot_channels)
+    return {'ms_per_frame': (time.perf_counter() - t_start) / num_frames * 1000}
+
+
+def envelope_accuracy(duration=120, num_channels=2, new_per_frame=7):
+    # =================================================================
+    # Envelopes of the frontend, on synthetic ECG (channel 0) and EEG
+    # filtered and decimated as in the frontend, against the Hilbert
+    # envelope of the whole recording (FFT, not causal)
+    # -----------------------------------------------------------------
+    # Output:
+    #   results             Dict of relative RMS error (%) of the
+    #                       streaming methods (delay compensated) and of
+    #                       the FFT of the window per frame, at the new
+    #                       samples of every frame
+    # =================================================================
+    config              = Configuration(num_channels=num_channels)
+    dsp                 = Processing(config)
+    source              = SyntheticSource(num_channels, config.sample_rate, real_time=False,
+        chunk_size=duration * config.sample_rate, duration=duration)
+    source.start()
+    filtered            = dsp.filter_bank.stream_filter().process(source.read())
+    filtered, _         = StreamingDecimator(config.downsampling,
+        config.sample_rate).process(filtered)
+    sample_rate         = config.sample_rate / config.downsampling
+    reference           = np.abs(scipy.signal.hilbert(filtered, axis=-1))
+    step                = max(1, new_per_frame // config.downsampling)
+    window              = int(config.buffer_length * sample_rate)
+    compared            = slice(window, filtered.shape[1] - window)
+
+    def error(envelope):
+        return float(100 * np.sqrt(np.mean((envelope[:, compared] - reference[:, compared])**2)) /
+            np.sqrt(np.mean(reference[:, compared]**2)))
+
+    results             = {}
+    for method in ('hilbert', 'lowpass'):
+        stage           = StreamingEnvelope(sample_rate, method)
+        envelope        = np.concatenate([stage.process(filtered[:, start:start + step])[0]
+            for start in range(0, filtered.shape[1], step)], axis=1)
+        # Compensate the (fractional) delay as the shifted time stamps do
+        index           = np.arange(envelope.shape[1])
+        results[method] = error(np.stack([np.interp(index + stage.delay, index, channel)
+            for channel in envelope]))
+
+    envelope            = np.zeros_like(filtered)
+    for last in range(window, filtered.shape[1] + 1, step):
+        envelope[:, last - step:last] = dsp.extract_envelope(
+            filtered[:, last - window:last])[:, -step:]
+    results['fft']      = error(envelope)
+    return results
+
+
+def benchmark_spectrum(num_channels, update_period=0.5, num_updates=200):
+    # =================================================================
+    # Output:
+    #   results             Dict of ms per spectral view update (every
+    #                       update_period s) for the running Welch PSD
+    #                       with quality index and for scipy.signal.welch
+    #                       over the same 4.5 s window
+    # =================================================================
+    sample_rate         = 200
+    monitor             = SpectralMonitor(num_channels, sample_rate)
+    rng                 = np.random.default_rng(0)
+    new_samples         = rng.standard_normal((num_channels, int(update_period * sample_rate)))
+    window              = rng.standard_normal((num_channels, monitor.segment +
+        (monitor.num_segments - 1) * monitor.hop))
+
+    t_start             = time.perf_counter()
+    for _ in range(num_updates):
+        monitor.process(new_samples)
+        monitor.quality()
+    t_running           = time.perf_counter() - t_start
+
+    t_start             = time.perf_counter()
+    for _ in range(num_updates):
+        scipy.signal.welch(window, sample_rate, nperseg=monitor.segment,
+            noverlap=monitor.segment - monitor.hop)
+    t_welch             = time.perf_counter() - t_start
+
+    return {'running': t_running / num_updates * 1000,
+        'welch': t_welch / num_updates * 1000}
+
+
+def benchmark_render(num_channels, num_points, num_frames=100):
+    # =================================================================
+    # Input:
+    #   num_channels        Channels drawn as one stacked curve
+    #   num_points          Points per channel
+    # Output:
+    #   results             Dict of ms per frame for setData alone and
+    #                       for setData plus a synchronous repaint, on an
+    #                       offscreen pyqtgraph PlotWidget
+    # =================================================================
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5                      import QtWidgets
+    import pyqtgraph
+    app                 = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv)
+
+    widget              = pyqtgraph.PlotWidget()
+    widget.resize(1000, 600)
+    widget.show()
+    rng                 = np.random.default_rng(0)
+    x                   = np.tile(np.arange(num_points, dtype=float), num_channels)
+    connect             = np.ones(num_points * num_channels, dtype=bool)
+    connect[num_points-1::num_points] = False
+    frames              = [rng.standard_normal(num_points * num_channels) for _ in range(8)]
+    curve               = widget.plot(x, frames[0], connect=connect)
+    app.processEvents()
+
+    t_start             = time.perf_counter()
+    for iFrame in range(num_frames):
+        curve.setData(x, frames[iFrame % len(frames)], connect=connect)
+    t_set_data          = (time.perf_counter() - t_start) / num_frames
+
+    t_start             = time.perf_counter()
+    for iFrame in range(num_frames):
+        curve.setData(x, frames[iFrame % len(frames)], connect=connect)
+        widget.viewport().repaint()
+    t_paint             = (time.perf_counter() - t_start) / num_frames
+
+    widget.close()
+    app.processEvents()
+    return {'set_data_ms': t_set_data * 1000, 'paint_ms': t_paint * 1000}
+
+
+def median_run(benchmark, repeat, *args, **kwargs):
+    # =================================================================
+    # Output:
+    #   results             Dict of the median of every value over
+    #                       repeat runs of benchmark(*args, **kwargs)
+    # =================================================================
+    runs                = []
+    for _ in range(repeat):
+        np.random.seed(0)
+        runs.append(benchmark(*args, **kwargs))
+    return {key: float(np.median([run[key] for run in runs])) for key in runs[0]}
+
+
+# Groups of the suite, run by default unless marked optional
+SUITE_GROUPS        = ['udp', 'buffer', 'decode', 'dsp', 'envelope', 'spectrum', 'render', 'metrics', 'startup', 'batch']
+OPTIONAL_GROUPS     = ['batch']
+
+
+def run_suite(groups=None, repeat=3):
+    # =================================================================
+    # Input:
+    #   groups              Groups of SUITE_GROUPS to run (default: all
+    #                       but the optional ones)
+    # Output:
+    #   results             Dict of name: {'value', 'unit',
+    #                       'higher_is_better'}
+    # =================================================================
+    if groups is None:
+        groups          = [group for group in SUITE_GROUPS if group not in OPTIONAL_GROUPS]
+    results             = {}
+
+    def add(name, value, unit, higher_is_better):
+        results[name]   = {'value': value, 'unit': unit,
+            'higher_is_better': higher_is_better}
+        print('  {:<40} {:>14,.3f} {}'.format(name, value, unit))
+        sys.stdout.flush()
+
+    if 'udp' in groups:
+        print('UDP loopback receive and decode')
+        for packet_format in ('json', 'binary'):
+            add('udp/' + packet_format, median_run(benchmark_udp_loopback, repeat,
+                packet_format)['samples_per_s'], 'samples/s', True)
+
+    if 'buffer' in groups:
+        print('Buffer update per sample')
+        for sample_rate in (200, 1000, 8000):
+            result      = median_run(benchmark_buffer_update, repeat, sample_rate)
+            add('buffer/ring/{}Hz'.format(sample_rate), 1e6 / result['ring'], 'us/sample', False)
+            add('buffer/concatenate/{}Hz'.format(sample_rate), 1e6 / result['legacy'], 'us/sample', False)
+
+    if 'decode' in groups:
+        print('Packet decoding (in memory)')
+        result          = median_run(benchmark_decode, repeat)
+        add('decode/json', result['json'], 'samples/s', True)
+        add('decode/binary', result['binary'], 'samples/s', True)
+
+    if 'dsp' in groups:
+        print('DSP per frame vs channel count and window length')
+        for num_channels in (2, 8, 32):
+            for buffer_length in (2, 5, 20):
+                add('dsp/frame/{}ch/{}s'.format(num_channels, buffer_length),
+                    median_run(benchmark_frame_dsp, repeat, num_channels,
+                    buffer_length)['ms_per_frame'], 'ms/frame', False)
+        result          = median_run(benchmark_frame_filtering, repeat)
+        add('dsp/whole_window_filter', 1000 / result['window'], 'ms/frame', False)
+        add('dsp/streaming_filter', 1000 / result['streaming'], 'ms/frame', False)
+        for num_channels in (2, 16, 64):
+            result      = median_run(benchmark_channel_scaling, repeat, num_channels)
+            add('dsp/window_envelope/{}ch'.format(num_channels), 1000 / result['vectorized'],
+                'ms/frame', False)
+            add('dsp/window_envelope/{}ch/loop'.format(num_channels), 1000 / result['loop'],
+                'ms/frame', False)
+        for factor in (5, 20):
+            result      = median_run(benchmark_decimation, repeat, 8, factor)
+            add('dsp/streaming_decimation/x{}'.format(factor), result['streaming'],
+                'ms/frame', False)
+            add('dsp/window_decimation/x{}'.format(factor), result['window'],
+                'ms/frame', False)
+            add('dsp/alias_rejection/x{}'.format(factor), decimation_alias_rejection(factor),
+                'dB', True)
+
+    if 'envelope' in groups:
+        print('Envelope per frame (8 channels) and error against the whole-recording Hilbert')
+        for method in ('rectified', 'fft', 'hilbert', 'lowpass'):
+            add('envelope/frame/' + method, median_run(benchmark_envelope, repeat, 8,
+                method)['ms_per_frame'], 'ms/frame', False)
+        for method, value in envelope_accuracy().items():
+            add('envelope/error/' + method, value, '% rms', False)
+
+    if 'spectrum' in groups:
+        print('Spectral view update (0.5 s of new samples)')
+        for num_channels in (2, 8, 32):
+            result      = median_run(benchmark_spectrum, repeat, num_channels)
+            add('spectrum/running_welch/{}ch'.format(num_channels), result['running'],
+                'ms/update', False)
+            add('spectrum/window_welch/{}ch'.format(num_channels), result['welch'],
+                'ms/update', False)
+
+    if 'render' in groups:
+        print('Offscreen pyqtgraph rendering')
+        for num_channels, num_points in ((1, 200), (4, 200), (16, 200), (4, 2000)):
+            result      = median_run(benchmark_render, repeat, num_channels, num_points)
+            name        = 'render/{}ch/{}pts'.format(num_channels, num_points)
+            add(name + '/set_data', result['set_data_ms'], 'ms/frame', False)
+            add(name + '/paint', result['paint_ms'], 'ms/frame', False)
+
+    if 'metrics' in groups:
+        print('Metrics overhead per read of the sample loop')
+        result          = median_run(benchmark_metrics_overhead, repeat)
+        add('metrics/overhead', 100 * result['overhead'], '%', False)
+
+    if 'startup' in groups:
+        print('Frontend start up: imports in a fresh interpreter')
+        result          = median_run(benchmark_startup_imports, repeat)
+        add('startup/import_frontend', 1000 * result['frontend'], 'ms', False)
+        add('startup/import_scipy_signal', 1000 * result['scipy_signal'], 'ms', False)
+
+    if 'batch' in groups:
+        print('Batch analysis (8 sessions x 2 channels x 10 min)')
+        for workers, (wall_time, speedup, efficiency) in benchmark_batch_scaling().items():
+            add('batch/{}workers'.format(workers), wall_time, 's', False)
+            add('batch/{}workers/speedup'.format(workers), speedup, 'x', True)
+            add('batch/{}workers/efficiency'.format(workers), efficiency, '', True)
+
+    return results
+
+
+def environment():
+    # Versions and machine the results were measured on
+    import scipy
+    return {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+        'numpy': np.__version__, 'scipy': scipy.__version__, 'platform': platform.platform(),
+        'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+
+
+def compare(results, baseline, tolerance=0.1):
+    # =================================================================
+    # Input:
+    #   results, baseline   Results as put out by run_suite
+    #   tolerance           Relative change that is still accepted
+    # Output:
+    #   regressions         List of (name, baseline value, value, change)
+    #                       that got worse by more than tolerance.
+    #                       change > 0 means slower
+    # =================================================================
+    regressions         = []
+    print('Comparison against baseline (tolerance {:.0%}, + is faster)'.format(tolerance))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old, new        = baseline[name]['value'], result['value']
+        if old == 0:
+            continue
+        change          = (old - new) / old if result['higher_is_better'] else (new - old) / old
+        flag            = 'REGRESSION' if change > tolerance else ''
+        print('  {:<40} {:>12,.3f} -> {:>12,.3f} {:<10} {:+7.1%} {}'.format(name, old, new,
+            result['unit'], -change, flag))
+        if change > tolerance:
+            regressions.append((name, old, new, change))
+    return regressions
+
+
+if __name__ == '__main__': # Necessary line for "multiprocessing" to work
+
+    parser = argparse.ArgumentParser(description='Benchmark the receiver, DSP '
+        'and rendering hot paths on synthetic data')
+    parser.add_argument('--output', default=None, help='Save results as JSON to this file')
+    parser.add_argument('--baseline', default=None, help='Compare against results saved with --output')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='Accepted relative slowdown (default 0.1)')
+    parser.add_argument('--only', nargs='+', choices=SUITE_GROUPS, default=None, help='Groups to run')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per benchmark, the median counts')
+    args = parser.parse_args()
+
+    results = run_suite(args.only, args.repeat)
+    if args.output is not None:
+        with open(args.output, 'w') as results_file:
+            json.dump({'environment': environment(), 'results': results}, results_file, indent=4)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        if regressions:
+            print('{} regressions'.format(len(regressions)))
+            sys.exit(1)
+        print('No regressions')
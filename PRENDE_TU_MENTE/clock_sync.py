@@ -0,0 +1,255 @@
+import numpy as np
+
+
+class SampleClock():
+
+    def __init__(self, sample_rate, window=10, gap_threshold=100,
+        burst_threshold=100, max_drift=1000, restart_time=1,
+        min_observations=10):
+        # =================================================================
+        # Time stamps from a running linear model of sample index against
+        # arrival time
+        # -----------------------------------------------------------------
+        # - Every read of samples is one observation: the last sample of
+        #   the read arrived at the arrival time
+        # - Slope (sampling period of the sender clock): exponentially
+        #   weighted least squares of index against arrival, observations
+        #   fading out over window seconds of samples, limited to
+        #   max_drift ppm from the nominal period
+        # - Offset: lower envelope of the arrivals (the least delayed
+        #   samples), rising by max_drift ppm at most. Only if all reads
+        #   for restart_time seconds after a gap arrive late, the stream
+        #   is taken to have restarted later and the offset moves.
+        #   Samples that were delayed more (UDP batching, scheduling) are
+        #   stamped as if they were not: jitter does not end up in the
+        #   time stamps, which are causal (never after arrival) and
+        #   monotonic
+        # - Reads arriving more than gap_threshold ms later than the
+        #   samples they hold account for are flagged as gaps (stalls).
+        #   Gaps and reads arriving later than gap_threshold ms above the
+        #   offset do not move the slope
+        # - Bursts (backlog delivered at once) are counted from the
+        #   lateness of the reads against the offset: once it fell by more
+        #   than burst_threshold ms from its peak. This holds whether the
+        #   backlog comes in one read or one sample per packet. A new
+        #   burst needs the lateness to rise by burst_threshold ms again
+        # Work per read is constant
+        # =================================================================
+        self.sample_rate    = sample_rate
+        self.window         = window * sample_rate # samples
+        self.gap_threshold  = gap_threshold # ms
+        self.burst_threshold= burst_threshold # ms
+        self.max_drift      = max_drift * 1e-6
+        self.restart_samples= restart_time * sample_rate
+        self.min_observations = min_observations
+        self.nominal_period = 1000 / sample_rate # ms
+        self.reset()
+
+
+    def reset(self):
+
+        self.num_samples    = 0 # Index of the next sample
+        self.observations   = 0
+        self.last_arrival   = None
+        self.last_stamp     = -np.inf
+        self.offset         = None # ms, arrival of sample 0 at least delay
+        self.restart        = None # Offset after the last gap, if late since
+        self.restart_span   = 0 # Samples since the last gap
+        self.restart_shift  = 0.0 # Sum of offset moves by restarts
+
+        # Weighted means and covariance of the slope fit, variance of the
+        # delay above the lower envelope
+        self.mean_index     = 0.0
+        self.mean_arrival   = 0.0
+        self.var_index      = 0.0
+        self.cov            = 0.0
+        self.var_residual   = 0.0
+
+        self.gaps           = 0
+        self.bursts         = 0
+        self.peak_lateness  = 0.0 # ms, since lateness last rose
+        self.low_lateness   = 0.0 # ms, since the last burst
+        self.recovered      = True # Last backlog counted as burst
+        self.lost_samples   = 0
+
+
+    @property
+    def period(self):
+        # Estimated sampling period (ms)
+        if self.observations < self.min_observations or self.var_index <= 0:
+            return self.nominal_period
+        return min(max(self.cov / self.var_index,
+            self.nominal_period * (1 - self.max_drift)),
+            self.nominal_period * (1 + self.max_drift))
+
+
+    def fit(self, index):
+        # Time stamp of sample index (ms)
+        return self.offset + self.period * index
+
+
+    def stamp(self, num_new, arrival_time, num_lost=0):
+        # =================================================================
+        # Input:
+        #   num_new             Number of samples just read
+        #   arrival_time        Time they arrived (ms)
+        #   num_lost            Samples known to be lost before them (e.g.
+        #                       from packet sequence gaps), so that the
+        #                       index keeps counting sampling periods
+        # Output:
+        #   time_stamps         Numpy 1D array [num_new] (ms)
+        # =================================================================
+        if num_new == 0:
+            return np.zeros(0)
+        self.num_samples    = self.num_samples + num_lost
+        self.lost_samples   = self.lost_samples + num_lost
+        indices             = self.num_samples + np.arange(num_new)
+        last_index          = indices[-1]
+        num_span            = num_new + num_lost
+
+        # Compare time since last read with the time the samples span
+        gap                 = False
+        if self.last_arrival is not None:
+            expected        = num_span * self.period
+            elapsed         = arrival_time - self.last_arrival
+            if elapsed - expected > self.gap_threshold:
+                self.gaps   = self.gaps + 1
+                gap         = True
+        self.last_arrival   = arrival_time
+
+        # Slope: weighted least squares on the last sample of each read,
+        # arrivals taken back by restarts of the stream
+        candidate           = arrival_time - self.period * last_index
+        late                = self.offset is not None and \
+            candidate - self.offset > self.gap_threshold
+        if not gap and not late:
+            alpha           = max(1 - np.exp(-num_span / self.window),
+                1 / (self.observations + 1))
+            d_index         = last_index - self.mean_index
+            d_arrival       = arrival_time - self.restart_shift - self.mean_arrival
+            self.mean_index     = self.mean_index + alpha * d_index
+            self.mean_arrival   = self.mean_arrival + alpha * d_arrival
+            self.var_index      = (1 - alpha) * (self.var_index + alpha * d_index * d_index)
+            self.cov            = (1 - alpha) * (self.cov + alpha * d_index * d_arrival)
+            self.observations   = self.observations + 1
+
+        # Offset: follow earlier arrivals at once, later ones slowly. After
+        # a gap the stream may have restarted later (lost samples nobody
+        # reported): move there if it stays late
+        if gap:
+            self.restart    = candidate
+            self.restart_span   = 0
+        elif self.restart is not None:
+            self.restart    = min(self.restart, candidate)
+            self.restart_span   = self.restart_span + num_span
+            if self.restart - self.offset < self.gap_threshold:
+                self.restart    = None
+            elif self.restart_span >= self.restart_samples:
+                self.restart_shift  = self.restart_shift + self.restart - self.offset
+                self.offset     = self.restart
+                self.restart    = None
+                self.recovered  = True # Late since the restart, no backlog
+                self.low_lateness   = candidate - self.offset
+
+        if self.offset is None:
+            self.offset     = candidate
+        elif not gap:
+            self.offset     = min(self.offset + self.max_drift * num_span * self.period,
+                candidate)
+            residual        = candidate - self.offset
+            alpha           = max(1 - np.exp(-num_span / self.window),
+                1 / max(self.observations, 1))
+            self.var_residual   = (1 - alpha) * (self.var_residual + alpha * residual * residual)
+        self.count_burst(candidate - self.offset)
+
+        # Causal and monotonic stamps on the sample grid
+        time_stamps         = self.fit(indices)
+        np.minimum(time_stamps, arrival_time, out=time_stamps)
+        np.maximum(time_stamps, self.last_stamp, out=time_stamps)
+        self.last_stamp     = time_stamps[-1]
+
+        self.num_samples    = self.num_samples + num_new
+        return time_stamps
+
+
+    def count_burst(self, lateness):
+        # =================================================================
+        # Input:
+        #   lateness            Arrival of the last sample of the read
+        #                       after its time on the offset (ms)
+        # =================================================================
+        if self.recovered:
+            self.low_lateness   = min(self.low_lateness, lateness)
+            if lateness - self.low_lateness > self.burst_threshold:
+                self.recovered  = False
+                self.peak_lateness  = lateness
+        else:
+            self.peak_lateness  = max(self.peak_lateness, lateness)
+            if self.peak_lateness - lateness > self.burst_threshold:
+                self.bursts     = self.bursts + 1
+                self.recovered  = True
+                self.low_lateness   = lateness
+
+
+    def statistics(self):
+        # =================================================================
+        # Output:
+        #   statistics          Dict of
+        #                       sample_rate     Estimated from arrivals (Hz)
+        #                       drift_ppm       Of the sender clock against
+        #                                       the receiver clock
+        #                       jitter_ms       Root mean square delay of
+        #                                       the arrivals above the
+        #                                       least delayed ones
+        #                       gaps            Number of flagged reads
+        #                       bursts          Number of backlogs delivered
+        #                       lost_samples    Reported by the caller
+        # =================================================================
+        return {
+            'sample_rate':  float(1000 / self.period),
+            'drift_ppm':    float((self.period / self.nominal_period - 1) * 1e6),
+            'jitter_ms':    float(np.sqrt(self.var_residual)),
+            'gaps':         self.gaps,
+            'bursts':       self.bursts,
+            'lost_samples': self.lost_samples}
+
+
+def simulate_stalls(samples_per_read, sample_rate=200, duration=30, num_stalls=5,
+    stall_time=300, jitter=2, seed=0):
+    # =================================================================
+    # Stream with num_stalls stalls of stall_time ms, each followed by
+    # its backlog 0.05 ms per sample apart, read samples_per_read at a
+    # time (1: Neuri JSON stream, one sample per datagram)
+    # -----------------------------------------------------------------
+    # Output:
+    #   statistics          SampleClock.statistics() after the stream
+    # =================================================================
+    rng                 = np.random.default_rng(seed)
+    clock               = SampleClock(sample_rate)
+    num_samples         = int(duration * sample_rate)
+    sent                = np.arange(num_samples) * 1000 / sample_rate
+    arrivals            = sent + 1 + np.abs(rng.normal(0, jitter, num_samples))
+    for iStall in range(num_stalls):
+        start           = 3000 + iStall * 5000
+        held            = np.flatnonzero((sent >= start) & (sent < start + stall_time))
+        arrivals[held]  = start + stall_time + 1 + 0.05 * np.arange(held.shape[0])
+    arrivals            = np.maximum.accumulate(arrivals)
+
+    for first in range(0, num_samples, samples_per_read):
+        last            = min(first + samples_per_read, num_samples)
+        clock.stamp(last - first, arrivals[last - 1])
+    return clock.statistics()
+
+
+if __name__ == '__main__':
+    # Check: every stall is one gap and its backlog one burst, however
+    # the backlog is split into reads
+    failed              = False
+    for samples_per_read in (1, 7, 40):
+        statistics      = simulate_stalls(samples_per_read)
+        passed          = statistics['gaps'] == 5 and statistics['bursts'] == 5
+        failed          = failed or not passed
+        print('{:>3} samples per read: {} gaps, {} bursts of 5 stalls {}'.format(
+            samples_per_read, statistics['gaps'], statistics['bursts'],
+            'ok' if passed else 'FAILED'))
+    raise SystemExit(failed)
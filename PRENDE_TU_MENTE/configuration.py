@@ -0,0 +1,81 @@
+class Configuration():
+
+    def __init__(self, **overrides):
+        # =================================================================
+        # Shared acquisition and display settings
+        # -----------------------------------------------------------------
+        # - One instance is handed to Backend, Processing and Frontend so
+        #   that stream parameters are only set here
+        # - Any attribute can be overridden by keyword, e.g.
+        #   Configuration(num_channels=8, sample_rate=250)
+        # =================================================================
+
+        # Streaming parameters
+        self.ip             = '127.0.0.1' # Localhost, requires Neuri GUI running
+        self.port           = 12344
+        self.source         = 'udp' # 'udp', 'replay' or 'synthetic'
+        self.replay_path    = None # Session directory for 'replay'
+        self.sample_rate    = 200 # Hz
+        self.num_channels   = 2 # Neuri boards V1.0
+
+        # Buffer parameters
+        self.buffer_length  = 5 # s
+        self.downsampling   = 5 # Downsampling factor (int)
+        self.clock_window   = 10 # s, time stamp fit (clock_sync.py)
+
+        # Filter parameters (digital_signal_processing.FilterBank)
+        self.line_noise     = 50 # Hz, 50 (Europe, ...) or 60 (Americas, ...)
+        self.passband       = 0.4 # Hz highpass cutoff, or (low, high)
+
+        # Display parameters
+        self.yrange         = [-200.0, +200.0] # float!
+        self.target_channel = 0 # Channel used for heart beat detection
+        self.plot_channels  = [0] # Channels drawn, stacked from the bottom
+        self.target_fps     = 30 # Frames per second of the plot (e.g. 30/60)
+        self.show_metrics   = False # Overlay of pipeline metrics (metrics.py)
+        self.show_spectrum  = False # Spectra and signal quality (spectral_monitor.py)
+        self.spectrum_fps   = 2 # Refresh rate of the spectral view
+        self.spectrum_budget= 0.05 # Share of CPU time the spectral view may take
+        self.saturation_level = None # uV, amplifier range (None: detect clipping)
+        self.envelope_method= 'rectified' # Plotted trace: 'rectified' (|x|),
+                                          # 'fft' (Hilbert of the window), or
+                                          # streaming 'hilbert' (11 % rms from
+                                          # the offline Hilbert envelope) or
+                                          # 'lowpass' (smoother, 22 % rms)
+
+        # Trigger parameters
+        self.trigger_mode   = 'beats' # 'beats' (detector) or 'amplitude'
+        self.sensitivity    = 0.75 # Beat detector sensitivity [0, 1]
+        self.refractory     = 0.25 # s, minimum time between beats
+        self.trigger_duration = 0.2 # s, trigger stays on after a beat
+
+        # Session recording (recorder.py), None to not record
+        self.output_dir     = None
+        self.subject_info   = {}
+
+        # Metrics export: Prometheus text on http://127.0.0.1:<port>/metrics
+        # and/or JSON lines appended to a file every second, None for off
+        self.metrics_port   = None
+        self.metrics_log    = None
+
+        # Arduino forwarding (trigger_control.py)
+        self.serial_port    = None # e.g. 'COM12', None to not forward
+        self.baud_rate      = 115200
+        self.control_interval = 0.001 # s, polling period of trigger loop
+
+        for key, value in overrides.items():
+            if not hasattr(self, key):
+                raise AttributeError('Unknown configuration parameter: ' + key)
+            setattr(self, key, value)
+
+
+    @property
+    def buffer_samples(self):
+        # Buffer length in samples
+        return int(self.buffer_length * self.sample_rate)
+
+
+    @property
+    def channel_names(self):
+        # Names of the channels as sent by the Neuri GUI
+        return ['c' + str(iChan + 1) for iChan in range(self.num_channels)]
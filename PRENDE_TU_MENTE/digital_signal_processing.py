@@ -1,68 +1,517 @@
-import scipy.signal
-from numpy                          import abs, zeros, pad
+import time
+from functools                      import lru_cache
+from threading                      import Thread, Event
+from numpy                          import abs, pad, vstack, concatenate, repeat, ceil, \
+    arange, zeros, hypot, pi, sqrt, maximum
+from numpy.lib.stride_tricks        import sliding_window_view
+from ring_buffer                    import RingBuffer
+from configuration                  import Configuration
+
+# scipy.signal is imported where it is used: importing it takes longer
+# than all other start up, which the frontend does not wait for (filters
+# are designed in the background, see Processing.prepare_in_background)
+
+
+@lru_cache(maxsize=64)
+def design_filter(btype, band, order, sample_rate, output='sos'):
+    # =================================================================
+    # Butterworth design, cached by filter spec and sample rate
+    # -----------------------------------------------------------------
+    # Input:
+    #   btype               'highpass', 'lowpass', 'bandpass', 'bandstop'
+    #   band                Cutoff (Hz), tuple (low, high) for band types
+    #   output              'sos' or 'ba'
+    # Output:
+    #   coefficients        sos array or (b, a)
+    #   zi_unit             Filter state of the step response (steady
+    #                       state for an input of 1)
+    # -----------------------------------------------------------------
+    # Results are shared by every caller in the process: do not modify
+    # (only the states are flagged read-only, sosfilt needs writable
+    # sections)
+    # =================================================================
+    import scipy.signal
+    coefficients        = scipy.signal.butter(order, band, btype=btype,
+        fs=sample_rate, output=output)
+    if output == 'sos':
+        zi_unit         = scipy.signal.sosfilt_zi(coefficients)
+    else:
+        zi_unit         = scipy.signal.lfilter_zi(*coefficients)
+    zi_unit.setflags(write=False)
+    return coefficients, zi_unit
+
+
+@lru_cache(maxsize=64)
+def cascade_filters(specs, sample_rate):
+    # =================================================================
+    # Input:
+    #   specs               Tuple of (btype, band, order), applied in
+    #                       this order
+    # Output:
+    #   sos                 Stacked sections of all filters
+    #   zi_unit             Step response state of the whole cascade
+    # =================================================================
+    import scipy.signal
+    sos                 = vstack([design_filter(btype, band, order, sample_rate)[0]
+        for btype, band, order in specs])
+    zi_unit             = scipy.signal.sosfilt_zi(sos)
+    zi_unit.setflags(write=False)
+    return sos, zi_unit
+
+
+@lru_cache(maxsize=64)
+def lfilter_initial_state(b, a):
+    # Step response state of (b, a) given as tuples, for filters that
+    # were not designed by design_filter
+    import scipy.signal
+    zi_unit             = scipy.signal.lfilter_zi(b, a)
+    zi_unit.setflags(write=False)
+    return zi_unit
+
+
+@lru_cache(maxsize=16)
+def design_decimation_filter(factor, attenuation=60, passband=0.7):
+    # =================================================================
+    # Input:
+    #   factor              Decimation factor of one stage
+    #   attenuation         Stopband attenuation (dB)
+    #   passband            Passband edge as fraction of the output
+    #                       Nyquist frequency
+    # Output:
+    #   h                   Lowpass FIR (Kaiser window, odd length from
+    #                       scipy.signal.kaiserord) attenuating by at
+    #                       least attenuation from the output Nyquist
+    #                       frequency on, so nothing aliases into the
+    #                       output band
+    # =================================================================
+    import scipy.signal
+    stop                = 1 / factor # Output Nyquist, relative to input
+    width               = (1 - passband) * stop
+    num_taps, beta      = scipy.signal.kaiserord(attenuation, width)
+    h                   = scipy.signal.firwin(num_taps | 1, stop - width / 2,
+        window=('kaiser', beta))
+    h.setflags(write=False)
+    return h
+
+
+def decimation_stages(factor, max_stage=8):
+    # =================================================================
+    # Split a decimation factor into stages of at most max_stage (larger
+    # prime factors stay one stage), largest first
+    # =================================================================
+    primes              = []
+    divisor             = 2
+    while factor > 1:
+        while factor % divisor == 0:
+            primes.append(divisor)
+            factor      = factor // divisor
+        divisor         = divisor + 1
+    stages              = []
+    for prime in sorted(primes, reverse=True):
+        for iStage, stage in enumerate(stages):
+            if stage * prime <= max_stage:
+                stages[iStage] = stage * prime
+                break
+        else:
+            stages.append(prime)
+    return sorted(stages, reverse=True)
+
+
+@lru_cache(maxsize=16)
+def design_hilbert_filter(num_taps):
+    # =================================================================
+    # Input:
+    #   num_taps            Odd filter length
+    # Output:
+    #   h                   FIR Hilbert transformer (ideal response
+    #                       2/(pi n) at odd n, Blackman window). Its
+    #                       delay is (num_taps - 1) / 2 samples
+    # =================================================================
+    import scipy.signal
+    n                   = arange(num_taps) - (num_taps - 1) // 2
+    h                   = zeros(num_taps)
+    odd                 = n % 2 != 0
+    h[odd]              = 2 / (pi * n[odd])
+    h                   = h * scipy.signal.get_window('blackman', num_taps, fftbins=False)
+    h.setflags(write=False)
+    return h
+
+
+class StreamingDecimator():
+
+    def __init__(self, factor, sample_rate, attenuation=60, max_stage=8):
+        # =================================================================
+        # Causal polyphase decimation that keeps its state between calls
+        # -----------------------------------------------------------------
+        # - factor is split into stages (decimation_stages), each an
+        #   anti-aliasing FIR evaluated only at the kept output samples:
+        #   work per call is proportional to the new samples
+        # - Output samples are those at multiples of factor of the whole
+        #   stream (as [:, ::factor] of all samples), their time stamps
+        #   are shifted back by the filter delay (self.delay, input
+        #   samples)
+        # - factor 1 passes samples through
+        # =================================================================
+        self.factor         = factor
+        self.sample_rate    = sample_rate
+        self.stage_factors  = decimation_stages(factor, max_stage)
+        self.stages         = [design_decimation_filter(stage, attenuation)
+            for stage in self.stage_factors]
+
+        # Group delay of the cascade in input samples
+        self.delay          = 0.0
+        rate                = 1
+        for h, stage in zip(self.stages, self.stage_factors):
+            self.delay      = self.delay + rate * (len(h) - 1) / 2
+            rate            = rate * stage
+        self.reset()
+
+
+    def reset(self):
+        self.histories      = [None] * len(self.stages)
+        self.num_inputs     = [0] * len(self.stages)
+        self.stamp_phase    = 0 # Input samples since the last kept one
+
+
+    def process(self, samples, time_stamps=None):
+        # =================================================================
+        # Input:
+        #   samples             Numpy array [channels x samples], the
+        #                       samples following the ones of last call
+        #   time_stamps         Numpy 1D array [samples] (ms), optional
+        # Output:
+        #   decimated           Numpy array [channels x kept samples]
+        #   decimated_stamps    Time stamps of the kept samples, minus the
+        #                       filter delay (None without time_stamps)
+        # =================================================================
+        decimated_stamps    = None
+        if time_stamps is not None:
+            first           = (-self.stamp_phase) % self.factor
+            decimated_stamps= time_stamps[first::self.factor] - \
+                self.delay * 1000 / self.sample_rate
+            self.stamp_phase= (self.stamp_phase + len(time_stamps)) % self.factor
+
+        for iStage, (h, stage) in enumerate(zip(self.stages, self.stage_factors)):
+            if samples.shape[1] == 0:
+                break
+            if self.histories[iStage] is None:
+                # Start in steady state of the first sample
+                self.histories[iStage] = repeat(samples[:, :1], len(h) - 1, axis=1)
+            extended        = concatenate((self.histories[iStage], samples), axis=1)
+            first           = (-self.num_inputs[iStage]) % stage
+            windows         = sliding_window_view(extended, len(h), axis=1)[:, first::stage]
+            self.histories[iStage] = extended[:, extended.shape[1] - len(h) + 1:]
+            self.num_inputs[iStage]= self.num_inputs[iStage] + samples.shape[1]
+            samples         = windows @ h[::-1]
+
+        return samples.astype(float, copy=False), decimated_stamps
+
+
+class StreamingEnvelope():
+
+    def __init__(self, sample_rate, method='hilbert', num_taps=None, cutoff=None):
+        # =================================================================
+        # Causal envelope that keeps its state between calls, constant
+        # work per new sample
+        # -----------------------------------------------------------------
+        #   method              'hilbert': magnitude of the analytic
+        #                       signal from an FIR Hilbert transformer of
+        #                       num_taps (default 0.3 s of samples, odd)
+        #                       'lowpass': square root of twice the
+        #                       squared signal smoothed by a 2nd order
+        #                       lowpass at cutoff (default sample_rate /
+        #                       5). The mean square of a narrowband signal
+        #                       is half that of its envelope, whatever
+        #                       the waveform. Smoother than 'hilbert' and
+        #                       with less delay, about twice its error
+        # -----------------------------------------------------------------
+        # Envelope time stamps are shifted back by the delay of the
+        # method (self.delay, samples), as in StreamingDecimator
+        # =================================================================
+        self.sample_rate    = sample_rate
+        self.method         = method
+        if method == 'hilbert':
+            if num_taps is None:
+                num_taps    = int(0.15 * sample_rate) * 2 + 1
+            self.h          = design_hilbert_filter(num_taps | 1)
+            self.delay      = (len(self.h) - 1) / 2
+        elif method == 'lowpass':
+            if cutoff is None:
+                cutoff      = sample_rate / 5
+            sos, zi_unit    = design_filter('lowpass', cutoff, 2, sample_rate)
+            self.smoother   = StreamingFilter(sos, zi_unit)
+            (b, a), _       = design_filter('lowpass', cutoff, 2, sample_rate, 'ba')
+            import scipy.signal
+            self.delay      = float(scipy.signal.group_delay((b, a), [0.01], fs=sample_rate)[1][0])
+        else:
+            raise ValueError('Unknown envelope method: ' + str(method))
+        self.reset()
+
+
+    def reset(self):
+        self.history        = None
+        if self.method == 'lowpass':
+            self.smoother.reset()
+
+
+    def process(self, samples, time_stamps=None):
+        # =================================================================
+        # Input:
+        #   samples             Numpy array [channels x samples], the
+        #                       samples following the ones of last call
+        #   time_stamps         Numpy 1D array [samples] (ms), optional
+        # Output:
+        #   envelope            Numpy array [channels x samples]
+        #   envelope_stamps     Time stamps minus the delay (None without
+        #                       time_stamps)
+        # =================================================================
+        envelope_stamps     = None
+        if time_stamps is not None:
+            envelope_stamps = time_stamps - self.delay * 1000 / self.sample_rate
+        if samples.shape[1] == 0:
+            return zeros(samples.shape), envelope_stamps
+
+        if self.method == 'lowpass':
+            mean_square     = self.smoother.process(samples ** 2)
+            return sqrt(maximum(2 * mean_square, 0)), envelope_stamps
+
+        # Hilbert transform at the centre of every window of the history
+        # plus new samples, real part delayed to the same sample
+        if self.history is None:
+            self.history    = zeros((samples.shape[0], len(self.h) - 1))
+        extended            = concatenate((self.history, samples), axis=1)
+        quadrature          = sliding_window_view(extended, len(self.h), axis=1) @ self.h[::-1]
+        centre              = (len(self.h) - 1) // 2
+        in_phase            = extended[:, centre:centre + samples.shape[1]]
+        self.history        = extended[:, samples.shape[1]:]
+        return hypot(in_phase, quadrature), envelope_stamps
+
+
+class FilterBank():
+
+    def __init__(self, sample_rate, order=3, passband=0.4, line_noise=50,
+        notch_width=4):
+        # =================================================================
+        # Named filters of the processing chain
+        # -----------------------------------------------------------------
+        # - 'Workshop': highpass at passband (Hz) or bandpass for a tuple
+        #   (low, high)
+        # - 'LineNoise': bandstop line_noise +- notch_width (Hz)
+        # - Designs come from the process-wide cache, so every stage and
+        #   channel using the same spec shares one set of coefficients.
+        #   Switching line noise (50/60 Hz) or passband at runtime only
+        #   looks up or designs the new spec once, never in a frame
+        # - version counts changes, so that users can refresh their
+        #   filters (see update)
+        # =================================================================
+        self.sample_rate    = sample_rate
+        self.order          = order
+        self.notch_width    = notch_width
+        self.specs          = {}
+        self.version        = 0
+        self.set_passband(passband)
+        self.set_line_noise(line_noise)
+
+
+    def set_line_noise(self, frequency):
+        self.line_noise     = frequency
+        self.specs['LineNoise'] = ('bandstop', (frequency - self.notch_width,
+            frequency + self.notch_width), self.order)
+        self.version        = self.version + 1
+
+
+    def set_passband(self, band):
+        self.passband       = band
+        if isinstance(band, (tuple, list)):
+            self.specs['Workshop'] = ('bandpass', tuple(band), self.order)
+        else:
+            self.specs['Workshop'] = ('highpass', band, self.order)
+        self.version        = self.version + 1
+
+
+    def sos(self, name):
+        # Output: sos, zi_unit of one named filter
+        return design_filter(*self.specs[name], self.sample_rate)
+
+
+    def ba(self, name):
+        # Output: (b, a), zi_unit of one named filter
+        return design_filter(*self.specs[name], self.sample_rate, output='ba')
+
+
+    def cascade(self, names=('LineNoise', 'Workshop')):
+        # Output: sos, zi_unit of the named filters applied in order
+        return cascade_filters(tuple(self.specs[name] for name in names),
+            self.sample_rate)
+
+
+    def stream_filter(self, names=('LineNoise', 'Workshop')):
+        # Output: new StreamingFilter of the named filters
+        return StreamingFilter(*self.cascade(names))
+
+
+    def update(self, stream_filter, names=('LineNoise', 'Workshop')):
+        # Switch an existing StreamingFilter to the current specs
+        stream_filter.set_sos(*self.cascade(names))
+
+
+class StreamingFilter():
+
+    def __init__(self, sos, zi_unit=None):
+        # =================================================================
+        # Causal IIR filter in second-order sections that keeps its state
+        # between calls, so that only newly arrived samples are filtered
+        # -----------------------------------------------------------------
+        #   sos                 Sections as put out by scipy.signal.butter
+        #                       (output='sos'), several filters can be
+        #                       cascaded by stacking their sections
+        #   zi_unit             Step response state of sos if known (see
+        #                       FilterBank), computed otherwise
+        # =================================================================
+        self.set_sos(sos, zi_unit)
+
+
+    def set_sos(self, sos, zi_unit=None):
+        # Replace the filter, e.g. after switching line noise frequency.
+        # The next call starts in steady state of its first sample, so
+        # there is no transient from the old state
+        self.sos            = sos
+        if zi_unit is None:
+            import scipy.signal
+            zi_unit         = scipy.signal.sosfilt_zi(sos)
+        self.zi_unit        = zi_unit # Step response state
+        self.zi             = None
+
+
+    def process(self, samples):
+        # =================================================================
+        # Input:
+        #   samples             Numpy array [channels x samples], the
+        #                       samples following the ones of last call
+        # Output:
+        #   filtered            Numpy array of same dimensions
+        # =================================================================
+        import scipy.signal
+        if samples.shape[1] == 0:
+            return samples.astype(float)
+        if self.zi is None:
+            # Start in steady state of the first sample (as lfilter_zi
+            # did for the whole-window filtering)
+            self.zi         = self.zi_unit[:, None, :] * samples[None, :, 0, None]
+        filtered, self.zi   = scipy.signal.sosfilt(self.sos, samples,
+            axis=1, zi=self.zi)
+        return filtered
+
+
+    def reset(self):
+        self.zi             = None
 
 
 class Processing():
 
-    def __init__(self):
-		
-		# These must be same as set in backend.py
-        self.sample_rate    = 200
-        self.buffer_length  = 5 * self.sample_rate
+    def __init__(self, config=None, prepare=True):
+
+        # Stream parameters are shared with backend.py via config
+        if config is None:
+            config          = Configuration()
+        self.sample_rate    = config.sample_rate
+        self.buffer_length  = config.buffer_samples
+        self.envelope_method= config.envelope_method
 
         #Signal processing
         self.filter_order   = 3 #scalar
-        self.frequency_bands= {
-            'Workshop':     (0.4,   2),
-            'LineNoise':    (46,    54)}
-        
-        self.prepare_filters()
+        self.filter_bank    = FilterBank(self.sample_rate, self.filter_order,
+            config.passband, config.line_noise)
+
+        # Set once prepare_streaming is done (see prepare_in_background).
+        # prepare=False leaves the filter design to the caller
+        self.streaming_ready= Event()
+        self.prepared_time  = None
+
+        if prepare:
+            self.prepare_filters()
 
 
     def prepare_filters(self):
 
-        # Bandpass filters
+        # Bandpass filters, designs are shared through the filter bank
         # -----------------------------------------------------------------
-        self.b_workshop, self.a_workshop        = scipy.signal.butter(
-            self.filter_order, self.frequency_bands["Workshop"][0],
-            btype='highpass', fs=self.sample_rate)
-        self.b_notch, self.a_notch              = scipy.signal.butter(
-            self.filter_order, self.frequency_bands["LineNoise"],
-            btype='bandstop', fs=self.sample_rate)
-
-        # Determine padding length for signal filtering
+        (self.b_workshop, self.a_workshop), _   = self.filter_bank.ba('Workshop')
+        (self.b_notch, self.a_notch), _         = self.filter_bank.ba('LineNoise')
+
+        # Same filters as second-order sections for streaming filtering
+        self.sos_workshop, _                    = self.filter_bank.sos('Workshop')
+        self.sos_notch, _                       = self.filter_bank.sos('LineNoise')
+
+        # Determine padding length for signal filtering (buffer_length is
+        # in samples already)
         # -----------------------------------------------------------------
         default_pad     = 3 * max(len(self.a_workshop), 
             len(self.b_workshop))
-        if default_pad > self.buffer_length * self.sample_rate/10-1:
+        if default_pad > self.buffer_length/10-1:
             self.padlen = int(default_pad) # Scipy expects int
         else:
-            self.padlen = int(self.buffer_length*self.sample_rate/10-1) # Scipy expects int
+            self.padlen = int(self.buffer_length/10-1) # Scipy expects int
+
+
+    def set_line_noise(self, frequency):
+        # =================================================================
+        # Switch the notch to another line noise frequency (50/60 Hz)
+        # while running
+        # =================================================================
+        self.filter_bank.set_line_noise(frequency)
+        self.refresh_filters()
+
+
+    def set_passband(self, band):
+        # =================================================================
+        # Input:
+        #   band                Highpass cutoff (Hz) or tuple (low, high)
+        #                       for a bandpass
+        # =================================================================
+        self.filter_bank.set_passband(band)
+        self.refresh_filters()
+
+
+    def refresh_filters(self):
+
+        self.prepare_filters()
+        if getattr(self, 'stream_filter', None) is not None:
+            self.filter_bank.update(self.stream_filter)
 
 
     def filter_signal(self, signal, b, a):
         # =================================================================
         # Input:
-        #   signal              Numpy 1D array [samples]
+        #   signal              Numpy array [samples] or [channels x
+        #                       samples], filtered along the last axis
         # Output:
-        #   signal_filtered[0]  1D numpy array of filtered signal where 
-        #                       first sample is 0
+        #   signal_filtered     Numpy array of filtered signal where first
+        #                       sample is 0
         # =================================================================
-        padded_signal   = pad(signal, (self.padlen, 0), 'symmetric')
-        init_state      = scipy.signal.lfilter_zi(b, a) # 1st sample --> 0
-        signal_filtered = scipy.signal.lfilter(b, a, padded_signal, 
-            zi=init_state*padded_signal[0])
-        signal_filtered = signal_filtered[0][self.padlen:]
-        return signal_filtered
+        import scipy.signal
+        pad_width       = [(0, 0)] * (signal.ndim - 1) + [(self.padlen, 0)]
+        padded_signal   = pad(signal, pad_width, 'symmetric')
+        init_state      = lfilter_initial_state(tuple(b), tuple(a)) # 1st sample --> 0
+        signal_filtered = scipy.signal.lfilter(b, a, padded_signal, axis=-1,
+            zi=init_state * padded_signal[..., :1])
+        return signal_filtered[0][..., self.padlen:]
 
 
     def extract_envelope(self, signal):
-        hilbert         = signal
-        for iChan in range(signal.shape[0]):
-            # padded_signal   = np.pad(signal[iChan,], (self.padlen, self.padlen), 'symmetric')
-            # hilbert[iChan,] = np.abs(scipy.signal.hilbert(padded_signal))[self.padlen:-self.padlen]
-            hilbert[iChan,] = abs(scipy.signal.hilbert(signal[iChan,]))
-        return hilbert
+        # =================================================================
+        # Input:
+        #   signal              Numpy array [channels x samples], left
+        #                       unchanged
+        # Output:
+        #   envelope            Numpy array of the Hilbert envelope along
+        #                       the last axis
+        # -----------------------------------------------------------------
+        # One FFT of the whole window per call. For the newest samples of
+        # a stream see StreamingEnvelope
+        # =================================================================
+        import scipy.signal
+        return abs(scipy.signal.hilbert(signal, axis=-1))
 
 
     def downsample(self, buffer, s_down):
@@ -70,17 +519,16 @@ class Processing():
         # Input:
         #   buffer              Numpy array [channels x samples]
         # Output:
-        #   downsamples_buffer  Numpy array of downsampled signal, same  
-        #                       dimensions as input buffer
+        #   downsamples_buffer  Numpy array [channels x ceil(samples /
+        #                       s_down)] of the anti-aliased signal at
+        #                       every s_down-th sample (zero phase, same
+        #                       filter as StreamingDecimator)
         # =================================================================
-        numchans            = buffer.shape[0]
-        downsampled_signal  = zeros((numchans, int(buffer.shape[1]/s_down)))
-        idx_retain = range(0, buffer.shape[1], s_down)
-        for iChan in range(numchans):
-            # downsampled_signal[iChan,] = scipy.signal.decimate(buffer[iChan,], s_down)
-            downsampled_signal[iChan,] = buffer[iChan,idx_retain]
-
-        return downsampled_signal
+        if s_down == 1:
+            return buffer.copy()
+        import scipy.signal
+        return scipy.signal.resample_poly(buffer, 1, s_down, axis=-1,
+            window=design_decimation_filter(s_down))
 
 
     def prepare_buffer(self, buffer, bSB, aSB, bPB, aPB):
@@ -95,25 +543,103 @@ class Processing():
         #   filtered_buffer     Numpy array of filtered signal, same  
         #                       dimensions as input buffer
         # =================================================================
-        buffer_shape        = buffer.shape
-        noise_free_signal   = zeros(buffer_shape)
-        filtered_buffer     = zeros(buffer_shape)
-        for iChan in range(buffer_shape[0]):
-
-            # Reject ambiant electrical noise (at 50 Hz)
-            # -------------------------------------------------------------
-            if all(bSB != None):
-                noise_free_signal[iChan,] = self.filter_signal(
-                    buffer[iChan,], bSB, aSB)
-            else:
-                noise_free_signal[iChan,] = buffer[iChan,]
-
-            # Extract useful frequency range
-            # -------------------------------------------------------------
-            if all(bPB != None):
-                filtered_buffer[iChan,] = self.filter_signal(
-                    noise_free_signal[iChan,], bPB, aPB)
-            else:
-                filtered_buffer[iChan,] = noise_free_signal[iChan,]
+        # Reject ambiant electrical noise (at 50 Hz), all channels at once
+        # -----------------------------------------------------------------
+        if bSB is not None:
+            noise_free_signal = self.filter_signal(buffer, bSB, aSB)
+        else:
+            noise_free_signal = buffer
+
+        # Extract useful frequency range
+        # -----------------------------------------------------------------
+        if bPB is not None:
+            return self.filter_signal(noise_free_signal, bPB, aPB)
+        return noise_free_signal.copy()
+
+
+    def prepare_streaming(self, num_channels, downsampling=1):
+        # =================================================================
+        # Set up incremental filtering: notch and passband cascaded in one
+        # stateful filter, then decimated by downsampling (anti-aliased,
+        # see StreamingDecimator). Output is collected in a ring buffer
+        # covering the same time as the raw buffer. Streaming envelope
+        # methods keep their envelope in a second ring of the same size
+        # =================================================================
+        self.stream_filter      = self.filter_bank.stream_filter()
+        self.decimator          = None
+        if downsampling > 1:
+            self.decimator      = StreamingDecimator(downsampling, self.sample_rate)
+        num_kept                = int(ceil(self.buffer_length / downsampling))
+        self.filtered_ring      = RingBuffer(num_channels, num_kept)
+
+        self.envelope_stage     = None
+        if self.envelope_method in ('hilbert', 'lowpass'):
+            self.envelope_stage = StreamingEnvelope(self.sample_rate / downsampling,
+                self.envelope_method)
+            self.envelope_ring  = RingBuffer(num_channels, num_kept)
+        elif self.envelope_method not in ('rectified', 'fft'):
+            raise ValueError('Unknown envelope method: ' + str(self.envelope_method))
+        self.prepared_time      = time.perf_counter()
+        self.streaming_ready.set()
+
+
+    def prepare_in_background(self, num_channels, downsampling=1):
+        # =================================================================
+        # Design the filters (prepare_filters) and set up streaming
+        # (prepare_streaming) in a thread, so that a window can show
+        # meanwhile. Nothing of either may be used before
+        # self.streaming_ready is set (at perf_counter time
+        # self.prepared_time, s)
+        # =================================================================
+        def prepare():
+            self.prepare_filters()
+            self.prepare_streaming(num_channels, downsampling)
+
+        preparation             = Thread(target=prepare, name='filter_design', daemon=True)
+        preparation.start()
+        return preparation
 
+
+    def filter_new_samples(self, samples, time_stamps):
+        # =================================================================
+        # Input:
+        #   samples             Numpy array [channels x samples], only the
+        #                       samples that arrived since last call
+        #   time_stamps         Numpy 1D array [samples]
+        # Output:
+        #   filtered_buffer     View [channels x buffer_length /
+        #                       downsampling] of the newest filtered (and
+        #                       decimated) samples, time stamps in
+        #                       self.filtered_ring
+        # =================================================================
+        filtered                = self.stream_filter.process(samples)
+        if self.decimator is not None:
+            filtered, time_stamps = self.decimator.process(filtered, time_stamps)
+        self.filtered_ring.extend(filtered, time_stamps)
+        if self.envelope_stage is not None:
+            self.envelope_ring.extend(*self.envelope_stage.process(filtered, time_stamps))
+        filtered_buffer, _      = self.filtered_ring.latest()
         return filtered_buffer
+
+
+    def envelope_new_samples(self, samples, time_stamps, channels=None):
+        # =================================================================
+        # Input:
+        #   samples, time_stamps As filter_new_samples
+        #   channels            Channels to return (default: all)
+        # Output:
+        #   envelope            Numpy array [channels x buffer_length /
+        #                       downsampling] by self.envelope_method
+        #   envelope_stamps     Numpy 1D array of its time stamps
+        # =================================================================
+        filtered_buffer         = self.filter_new_samples(samples, time_stamps)
+        if self.envelope_stage is not None:
+            envelope, envelope_stamps = self.envelope_ring.latest()
+            return envelope if channels is None else envelope[channels], envelope_stamps
+
+        _, envelope_stamps      = self.filtered_ring.latest()
+        if channels is not None:
+            filtered_buffer     = filtered_buffer[channels]
+        if self.envelope_method == 'fft':
+            return self.extract_envelope(filtered_buffer), envelope_stamps
+        return abs(filtered_buffer), envelope_stamps
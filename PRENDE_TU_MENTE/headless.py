@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+from configuration                  import Configuration
+from digital_signal_processing      import Processing
+from beat_detection                 import BeatDetector
+from sample_sources                 import ReplaySource, SyntheticSource
+from metrics                        import MetricsRegistry
+
+
+def run_pipeline(source, output_dir, config, time_stamps=None, metrics=None):
+    # =================================================================
+    # Stream a finite source through filtering and beat detection in
+    # large chunks, without GUI or board
+    # -----------------------------------------------------------------
+    # Input:
+    #   source              Finite sample source with real_time=False
+    #   output_dir          Directory for the results:
+    #                         filtered.npy   float32 [channels x samples]
+    #                         beats.csv      time (ms), heart rate (bpm),
+    #                                        detection latency (ms)
+    #                         summary.json   counts and throughput
+    #   config              Configuration (sample rate, channels, ...)
+    #   time_stamps         Numpy 1D array of the source samples (ms),
+    #                       default: derived from the sample rate
+    #   metrics             MetricsRegistry to count samples and time the
+    #                       processing of every chunk (dsp_ms)
+    # Output:
+    #   summary             Dict as written to summary.json
+    # =================================================================
+    os.makedirs(output_dir, exist_ok=True)
+    if metrics is None:
+        metrics         = MetricsRegistry()
+    packets_received    = metrics.counter('packets_received')
+    samples_received    = metrics.counter('samples_received')
+    dsp_timer           = metrics.timer('dsp_ms')
+    dsp                 = Processing(config)
+    stream_filter       = dsp.filter_bank.stream_filter()
+    detector            = BeatDetector(config.sample_rate, config.sensitivity, config.refractory)
+
+    filtered_file       = np.lib.format.open_memmap(os.path.join(output_dir, 'filtered.npy'),
+        'w+', np.float32, (config.num_channels, source.num_samples))
+
+    beats               = []
+    num_processed       = 0
+    t_start             = time.perf_counter()
+    source.start()
+    while not source.finished:
+        samples         = source.read()
+        if samples is None:
+            continue
+        num_new         = samples.shape[1]
+        if time_stamps is not None:
+            stamps      = time_stamps[num_processed:num_processed + num_new]
+        else:
+            stamps      = (num_processed + np.arange(num_new)) * 1000 / config.sample_rate
+
+        with dsp_timer:
+            filtered_file[:, num_processed:num_processed + num_new] = \
+                stream_filter.process(np.asarray(samples, dtype=float))
+            beats.extend(detector.process(np.asarray(samples[config.target_channel], dtype=float), stamps))
+        num_processed   = num_processed + num_new
+        packets_received.increment()
+        samples_received.increment(num_new)
+    duration            = time.perf_counter() - t_start
+    source.close()
+
+    filtered_file.flush()
+    np.savetxt(os.path.join(output_dir, 'beats.csv'),
+        np.array([tuple(beat) for beat in beats]).reshape(-1, 3), delimiter=',',
+        fmt='%.3f', header='time_stamp_ms,heart_rate_bpm,latency_ms', comments='')
+
+    rates               = [beat.heart_rate for beat in beats[1:]]
+    summary             = {
+        'num_samples':      num_processed,
+        'recording_length': num_processed / config.sample_rate,
+        'num_beats':        len(beats),
+        'mean_heart_rate':  float(np.mean(rates)) if rates else None,
+        'processing_time':  duration,
+        'throughput':       num_processed / duration,
+        'real_time_factor': num_processed / config.sample_rate / duration}
+    with open(os.path.join(output_dir, 'summary.json'), 'w') as summary_file:
+        json.dump(summary, summary_file, indent=4)
+    return summary
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Process a recorded session '
+        '(or synthetic data) through filtering and beat detection')
+    parser.add_argument('session', nargs='?', help='Session directory written by recorder.py')
+    parser.add_argument('--synthetic', type=float, metavar='SECONDS',
+        help='Process generated ECG/EEG of this length instead of a session')
+    parser.add_argument('--output', required=True, help='Directory for results')
+    parser.add_argument('--chunk', type=float, default=60, help='Chunk length (s)')
+    parser.add_argument('--channels', type=int, default=2, help='Channels (synthetic)')
+    parser.add_argument('--sample-rate', type=float, default=200, help='Sample rate (synthetic)')
+    parser.add_argument('--metrics-port', type=int, default=None,
+        help='Serve metrics (Prometheus text) on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--metrics-log', default=None, help='Append metrics as JSON lines to this file every second')
+    args = parser.parse_args()
+
+    if args.synthetic is not None:
+        config  = Configuration(num_channels=args.channels, sample_rate=args.sample_rate)
+        source  = SyntheticSource(config.num_channels, config.sample_rate, real_time=False,
+            chunk_size=args.chunk * config.sample_rate, duration=args.synthetic)
+        stamps  = None
+    elif args.session is not None:
+        source  = ReplaySource(args.session, real_time=False)
+        config  = Configuration(num_channels=len(source.header['channel_names']),
+            sample_rate=source.header['sample_rate'])
+        source.chunk_size = int(args.chunk * config.sample_rate)
+        stamps  = source.time_stamps
+    else:
+        parser.error('Give a session directory or --synthetic SECONDS')
+
+    config.metrics_port = args.metrics_port
+    config.metrics_log  = args.metrics_log
+    metrics = MetricsRegistry()
+    metrics.start_export(config)
+
+    summary = run_pipeline(source, args.output, config, stamps, metrics)
+    print('{num_samples} samples ({recording_length:.0f} s), {num_beats} beats, '
+        '{throughput:,.0f} samples/s ({real_time_factor:,.0f}x real time)'.format(**summary))
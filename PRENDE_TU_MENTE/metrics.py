@@ -0,0 +1,228 @@
+import json
+import time
+from multiprocessing                import RawArray
+from threading                      import Thread
+from http.server                    import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# =====================================================================
+# Metrics of the pipeline: (name, kind, help)
+# ---------------------------------------------------------------------
+#   counter     Only increases
+#   gauge       Current value
+#   timer       Durations (ms): count, sum, max and last value
+# =====================================================================
+PIPELINE_METRICS = [
+    ('packets_received',    'counter',  'Reads that delivered samples'),
+    ('samples_received',    'counter',  'Samples written to the ring buffer'),
+    ('packets_skipped',     'gauge',    'Packets that could not be decoded'),
+    ('packets_lost',        'gauge',    'Packets missing in the sequence'),
+    ('recorder_queue_depth','gauge',    'Chunks waiting for the recorder thread'),
+    ('recorder_overflows',  'gauge',    'Samples dropped by the recorder'),
+    ('clock_jitter_ms',     'gauge',    'Arrival jitter around the sample clock (ms)'),
+    ('sample_loop_ms',      'timer',    'Processing time per read in the sampling process'),
+    ('dsp_ms',              'timer',    'Filtering and envelope time per frame'),
+    ('render_ms',           'timer',    'Plot update time per frame'),
+    ('frames_dropped',      'gauge',    'Timer ticks missed by the plot'),
+    ('frame_rate',          'gauge',    'Rendered frames per second'),
+    ('edge_queue_depth',    'gauge',    'Trigger edges waiting for the serial writer'),
+    ('edges_dropped',       'gauge',    'Trigger edges dropped (queue full)'),
+    ('trigger_latency_ms',  'timer',    'Sample arrival to serial write (ms)'),
+    ('beat_latency_ms',     'timer',    'R-peak to serial write, beats mode (ms)'),
+    ('spectrum_ms',         'timer',    'Spectral view update time'),
+    ('signal_quality',      'gauge',    'Signal quality index of the target channel [0, 1]'),
+    ('startup_ms',          'gauge',    'Launch of the frontend to its first plotted frame (ms)')]
+
+TIMER_FIELDS        = ('count', 'sum', 'max', 'last')
+
+
+class Counter():
+
+    def __init__(self, values, index):
+        self.values         = values
+        self.index          = index
+
+
+    def increment(self, amount=1):
+        self.values[self.index] += amount
+
+
+class Gauge():
+
+    def __init__(self, values, index):
+        self.values         = values
+        self.index          = index
+
+
+    def set(self, value):
+        self.values[self.index] = value
+
+
+class Timer():
+
+    def __init__(self, values, index):
+        # Four slots from index: count, sum, max and last duration (ms)
+        self.values         = values
+        self.index          = index
+        self.start_time     = None
+
+
+    def observe(self, duration):
+        values, index       = self.values, self.index
+        values[index]       += 1
+        values[index + 1]   += duration
+        if duration > values[index + 2]:
+            values[index + 2] = duration
+        values[index + 3]   = duration
+
+
+    def __enter__(self):
+        self.start_time     = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *args):
+        self.observe((time.perf_counter() - self.start_time) * 1000)
+
+
+class MetricsRegistry():
+
+    def __init__(self, definitions=PIPELINE_METRICS):
+        # =================================================================
+        # Counters, gauges and timers in one shared memory array
+        # -----------------------------------------------------------------
+        # - Created before the sampling and control processes are started
+        #   and handed to them, so that every process updates the same
+        #   values and any process can read all of them
+        # - Handles (counter(), gauge(), timer()) write to their slot
+        #   directly: no locks, no allocation, a fraction of a microsecond
+        #   per update. Every metric has a single writing process
+        # =================================================================
+        self.definitions    = list(definitions)
+        self.slots          = {}
+        num_slots           = 0
+        for name, kind, _ in self.definitions:
+            self.slots[name]= num_slots
+            num_slots       = num_slots + (len(TIMER_FIELDS) if kind == 'timer' else 1)
+        self.values         = RawArray('d', num_slots)
+
+
+    def counter(self, name):
+        return Counter(self.values, self.slots[name])
+
+
+    def gauge(self, name):
+        return Gauge(self.values, self.slots[name])
+
+
+    def timer(self, name):
+        return Timer(self.values, self.slots[name])
+
+
+    def snapshot(self):
+        # =================================================================
+        # Output:
+        #   snapshot            Dict of name: value, timers as dict of
+        #                       count, mean, max and last (ms)
+        # =================================================================
+        values              = self.values[:]
+        snapshot            = {}
+        for name, kind, _ in self.definitions:
+            index           = self.slots[name]
+            if kind == 'timer':
+                count, total, maximum, last = values[index:index + len(TIMER_FIELDS)]
+                snapshot[name] = {'count': int(count),
+                    'mean': total / count if count else 0.0,
+                    'max': maximum, 'last': last}
+            else:
+                snapshot[name] = values[index]
+        return snapshot
+
+
+    def prometheus_text(self, prefix='prende_'):
+        # =================================================================
+        # Output:
+        #   text                Prometheus text exposition format, timers
+        #                       as summaries (_count, _sum) plus _max
+        # =================================================================
+        values              = self.values[:]
+        lines               = []
+        for name, kind, help_text in self.definitions:
+            index           = self.slots[name]
+            metric          = prefix + name
+            lines.append('# HELP {} {}'.format(metric, help_text))
+            if kind == 'timer':
+                lines.append('# TYPE {} summary'.format(metric))
+                lines.append('{}_count {}'.format(metric, values[index]))
+                lines.append('{}_sum {}'.format(metric, values[index + 1]))
+                lines.append('{}_max {}'.format(metric, values[index + 2]))
+            else:
+                lines.append('# TYPE {} {}'.format(metric, kind))
+                lines.append('{} {}'.format(metric, values[index]))
+        return '\n'.join(lines) + '\n'
+
+
+    def report(self):
+        # Short text of all metrics for display
+        lines               = []
+        for name, value in self.snapshot().items():
+            if isinstance(value, dict):
+                lines.append('{:<22}{:>9.3f} ms mean {:>9.3f} max'.format(name,
+                    value['mean'], value['max']))
+            else:
+                lines.append('{:<22}{:>9.6g}'.format(name, value))
+        return '\n'.join(lines)
+
+
+    def serve_http(self, port, ip='127.0.0.1'):
+        # =================================================================
+        # Serve prometheus_text() on http://ip:port/metrics from a daemon
+        # thread. Output: the server (call shutdown() to stop)
+        # =================================================================
+        registry            = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body        = registry.prometheus_text().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass # Scrapes are not worth a line on the console
+
+        server              = ThreadingHTTPServer((ip, int(port)), MetricsHandler)
+        Thread(target=server.serve_forever, name='metrics_http', daemon=True).start()
+        return server
+
+
+    def log_json(self, path, interval=1):
+        # =================================================================
+        # Append a snapshot as one JSON line to path every interval
+        # seconds, from a daemon thread. Output: the thread
+        # =================================================================
+        def write_snapshots():
+            with open(path, 'a') as log_file:
+                while True:
+                    time.sleep(interval)
+                    log_file.write(json.dumps({'time': time.time(),
+                        **self.snapshot()}) + '\n')
+                    log_file.flush()
+
+        writer              = Thread(target=write_snapshots, name='metrics_log', daemon=True)
+        writer.start()
+        return writer
+
+
+    def start_export(self, config):
+        # Start the exports selected by config (metrics_port, metrics_log)
+        if config.metrics_port is not None:
+            self.serve_http(config.metrics_port)
+        if config.metrics_log is not None:
+            self.log_json(config.metrics_log)
@@ -0,0 +1,234 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+from collections                    import namedtuple
+from threading                      import Thread
+from ring_buffer                    import RingBuffer, SharedRingBuffer
+from wire_format                    import decode_packet, sequence_gap
+from recorder                       import SessionRecorder
+from clock_sync                     import SampleClock
+
+
+# Board streaming to one UDP port
+#   name            Tag of the samples, e.g. 'board1'
+#   ip, port        Address the receiver listens on
+#   num_channels    Channels sent by the board
+Device = namedtuple('Device', ['name', 'ip', 'port', 'num_channels'])
+
+
+class DeviceProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, device, ring, sample_rate, start_time, warm_up=0.5,
+        recorder=None):
+        # =================================================================
+        # Receives the packets of one device into its ring buffer
+        # -----------------------------------------------------------------
+        # - Packets arriving within warm_up seconds of the start are
+        #   discarded (backlog of the sender), without waiting for them
+        # - Binary packets are checked for gaps in their sequence: lost
+        #   packets are counted, late or duplicated ones dropped
+        # - Samples are stamped by the device clock fit (clock_sync.py)
+        # =================================================================
+        self.device         = device
+        self.ring           = ring
+        self.sample_rate    = sample_rate
+        self.start_time     = start_time # ms, perf_counter clock
+        self.warm_up_end    = time.perf_counter() + warm_up
+        self.recorder       = recorder
+        self.transport      = None
+        self.clock          = SampleClock(sample_rate)
+
+        self.packets        = 0
+        self.flushed        = 0 # Discarded during warm up
+        self.skipped        = 0 # Not decodable
+        self.lost_packets   = 0
+        self.reordered      = 0
+        self.last_sequence  = None
+
+
+    def connection_made(self, transport):
+        self.transport      = transport
+
+
+    def datagram_received(self, data, addr):
+
+        now                 = time.perf_counter()
+        if now < self.warm_up_end:
+            self.flushed    = self.flushed + 1
+            return
+        time_stamp          = now * 1000 - self.start_time
+
+        samples, sequence   = decode_packet(data, len(data), self.device.num_channels)
+        if samples is None:
+            self.skipped    = self.skipped + 1
+            return
+        gap                 = 0
+        if sequence is not None:
+            gap             = sequence_gap(self.last_sequence, sequence)
+            if gap < 0:
+                self.reordered  = self.reordered + 1
+                return
+            self.lost_packets   = self.lost_packets + gap
+            self.last_sequence  = sequence
+        self.packets        = self.packets + 1
+
+        time_stamps         = self.clock.stamp(samples.shape[1], time_stamp,
+            gap * samples.shape[1])
+        self.ring.extend(samples, time_stamps)
+        if self.recorder is not None:
+            self.recorder.write(samples, time_stamps)
+
+
+    def statistics(self):
+        # Output: dict of packet counters of this device
+        return {
+            'device':       self.device.name,
+            'port':         self.device.port,
+            'packets':      self.packets,
+            'samples':      self.ring.total_written,
+            'lost_packets': self.lost_packets,
+            'reordered':    self.reordered,
+            'skipped':      self.skipped,
+            'flushed':      self.flushed,
+            **self.clock.statistics()}
+
+
+class MultiReceiver():
+
+    def __init__(self, devices, sample_rate, buffer_samples, warm_up=0.5,
+        shared=False, output_dir=None, subject_info=None):
+        # =================================================================
+        # Several boards received by one asyncio event loop in one thread
+        # -----------------------------------------------------------------
+        #   devices             List of Device, one port each
+        #   buffer_samples      Length of the ring buffer of every device
+        #   shared              Ring buffers in shared memory, to be read
+        #                       by other processes (see ring_buffer.py)
+        #   output_dir          Record every device to a session in
+        #                       output_dir/<device name> (None: no
+        #                       recording)
+        # -----------------------------------------------------------------
+        # Samples are tagged by device: self.rings[name] holds the stream
+        # of device name, self.protocols[name] its packet counters
+        # -----------------------------------------------------------------
+        # Command line only (see __main__): the frontend displays and
+        # triggers on one board, received by Backend.fill_buffer
+        # =================================================================
+        self.devices        = list(devices)
+        self.sample_rate    = sample_rate
+        self.warm_up        = warm_up # s
+        self.start_time     = time.perf_counter() * 1000 # ms
+
+        ring_type           = SharedRingBuffer if shared else RingBuffer
+        self.rings          = {device.name: ring_type(device.num_channels, buffer_samples)
+            for device in self.devices}
+        self.recorders      = {}
+        if output_dir is not None:
+            for device in self.devices:
+                self.recorders[device.name] = SessionRecorder(
+                    os.path.join(output_dir, device.name), subject_info or {},
+                    sample_rate, ['c' + str(iChan + 1) for iChan in range(device.num_channels)])
+
+        self.protocols      = {}
+        self.loop           = None
+        self.thread         = None
+
+
+    def start(self):
+        # =================================================================
+        # Bind all ports and receive in a background thread. Returns once
+        # every port is bound (errors, e.g. a port in use, are raised here)
+        # =================================================================
+        self.loop           = asyncio.new_event_loop()
+        self.loop.run_until_complete(self.open_endpoints())
+        self.thread         = Thread(target=self.loop.run_forever,
+            name='multi_receiver', daemon=True)
+        self.thread.start()
+
+
+    async def open_endpoints(self):
+
+        try:
+            for device in self.devices:
+                recorder    = self.recorders.get(device.name)
+                if recorder is not None:
+                    recorder.start()
+                _, protocol = await self.loop.create_datagram_endpoint(
+                    lambda device=device, recorder=recorder: DeviceProtocol(device,
+                        self.rings[device.name], self.sample_rate,
+                        self.start_time, self.warm_up, recorder),
+                    local_addr=(device.ip, int(device.port)))
+                self.protocols[device.name] = protocol
+        except OSError:
+            self.close_endpoints()
+            raise
+
+
+    def close_endpoints(self):
+
+        for protocol in self.protocols.values():
+            protocol.transport.close()
+        for recorder in self.recorders.values():
+            recorder.stop()
+
+
+    def stop(self, timeout=2):
+        # =================================================================
+        # Close all ports and stop the loop from any thread, then wait
+        # for the receiving thread (at most timeout s). The loop is only
+        # closed once the thread left it: a running loop cannot be
+        # closed. Returns whether the thread has stopped
+        # =================================================================
+        if self.thread is None:
+            return True
+        self.loop.call_soon_threadsafe(self.close_endpoints)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            return False
+        self.thread         = None
+        self.loop.close()
+        return True
+
+
+    def statistics(self):
+        # Output: list of per-device packet counters
+        return [self.protocols[device.name].statistics()
+            for device in self.devices if device.name in self.protocols]
+
+
+    def close(self):
+        # Release shared memory of the ring buffers (after stop)
+        for ring in self.rings.values():
+            if isinstance(ring, SharedRingBuffer):
+                ring.close()
+
+
+if __name__ == '__main__': # Necessary line for "multiprocessing" to work
+
+    parser = argparse.ArgumentParser(description='Receive several boards '
+        'at once (one port each) and print per-device packet statistics')
+    parser.add_argument('--ports', type=int, nargs='+', required=True, help='UDP ports, one per board')
+    parser.add_argument('--ip', default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--channels', type=int, default=2, help='Channels per board')
+    parser.add_argument('--sample-rate', type=float, default=200, help='Sample rate (Hz)')
+    parser.add_argument('--output', default=None, help='Record every board to a session in this directory')
+    args = parser.parse_args()
+
+    devices  = [Device('board' + str(iDev + 1), args.ip, port, args.channels)
+        for iDev, port in enumerate(args.ports)]
+    receiver = MultiReceiver(devices, args.sample_rate, int(5 * args.sample_rate),
+        output_dir=args.output)
+    receiver.start()
+    print('Receiving {} boards, Ctrl+C to stop'.format(len(devices)))
+    try:
+        while True:
+            time.sleep(1)
+            print('  '.join('{device}: {samples} samples, {lost_packets} lost'.format(**stats)
+                for stats in receiver.statistics()))
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    receiver.stop()
@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import queue
+import numpy as np
+from threading                      import Thread
+
+
+class SessionRecorder():
+
+    def __init__(self, output_dir, subject_info, sample_rate, channel_names,
+        chunk_length=60, queue_size=256, header_interval=1):
+        # =================================================================
+        # Append-only recorder of the raw stream
+        # -----------------------------------------------------------------
+        # A session is a directory holding
+        # - samples.f32         float32 [samples x channels], memory-mapped
+        # - time_stamps.f64     float64 [samples] (ms), memory-mapped
+        # - header.json         sample rate, channel names, subject info
+        #                       and the number of valid samples
+        # Files grow by chunk_length seconds at a time. write() only puts
+        # a copy on a bounded queue: a writer thread does the file work,
+        # samples that do not fit on the queue are counted as overflows
+        # =================================================================
+        self.session_dir    = os.path.join(output_dir,
+            time.strftime('session_%Y%m%d_%H%M%S'))
+        self.header         = {
+            'sample_rate':      sample_rate,
+            'channel_names':    list(channel_names),
+            'subject_info':     subject_info,
+            'start_time':       time.strftime('%Y-%m-%d %H:%M:%S'),
+            'num_samples':      0,
+            'overflows':        0}
+        # Entries for the header from other threads (see update_header)
+        self.header_updates = {}
+        self.num_channels   = len(channel_names)
+        self.chunk_samples  = int(chunk_length * sample_rate)
+        self.queue_size     = queue_size
+        self.header_interval= header_interval # s between header updates
+
+        self.num_samples    = 0
+        self.overflows      = 0 # Samples lost because the queue was full
+        self.writer         = None
+
+
+    def start(self):
+        # =================================================================
+        # Create the session files and start the writer thread. Call in
+        # the process that writes (threads do not survive process starts)
+        # =================================================================
+        os.makedirs(self.session_dir, exist_ok=True)
+        self.samples_file   = open(os.path.join(self.session_dir, 'samples.f32'), 'wb+')
+        self.stamps_file    = open(os.path.join(self.session_dir, 'time_stamps.f64'), 'wb+')
+        self.capacity       = 0
+        self.grow()
+        self.write_header()
+
+        self.pending        = queue.Queue(maxsize=self.queue_size)
+        self.writer         = Thread(target=self.write_chunks,
+            name='recorder_thread', daemon=True)
+        self.writer.start()
+
+
+    def write(self, samples, time_stamps):
+        # =================================================================
+        # Input:
+        #   samples             Numpy array [channels x samples]
+        #   time_stamps         Numpy 1D array [samples] (ms)
+        # -----------------------------------------------------------------
+        # Never blocks: inputs are copied since they are usually views
+        # into the receive or ring buffer
+        # =================================================================
+        try:
+            self.pending.put_nowait((samples.T.astype(np.float32),
+                np.array(time_stamps, dtype=np.float64)))
+        except queue.Full:
+            self.overflows  = self.overflows + samples.shape[1]
+
+
+    def grow(self):
+
+        # Extend files by one chunk and map them again. Mapped files
+        # cannot be resized on Windows: unmap first
+        if self.capacity > 0:
+            self.samples.flush()
+            self.time_stamps.flush()
+            self.samples    = None
+            self.time_stamps= None
+        self.capacity       = self.capacity + self.chunk_samples
+        self.samples_file.truncate(self.capacity * self.num_channels * 4)
+        self.stamps_file.truncate(self.capacity * 8)
+        self.samples        = np.memmap(self.samples_file, np.float32, 'r+',
+            shape=(self.capacity, self.num_channels))
+        self.time_stamps    = np.memmap(self.stamps_file, np.float64, 'r+',
+            shape=(self.capacity,))
+
+
+    def write_chunks(self):
+
+        last_header         = time.perf_counter()
+        while True:
+            try:
+                item        = self.pending.get(timeout=self.header_interval)
+            except queue.Empty:
+                item        = ()
+            if item is None:
+                break
+
+            if item:
+                samples, time_stamps = item
+                num_new     = samples.shape[0]
+                while self.num_samples + num_new > self.capacity:
+                    self.grow()
+                self.samples[self.num_samples:self.num_samples + num_new] = samples
+                self.time_stamps[self.num_samples:self.num_samples + num_new] = time_stamps
+                self.num_samples = self.num_samples + num_new
+
+            # Keep header current so that a killed process loses at most
+            # the last header_interval of the session
+            if time.perf_counter() - last_header >= self.header_interval:
+                self.samples.flush()
+                self.time_stamps.flush()
+                self.write_header()
+                last_header = time.perf_counter()
+
+        self.samples.flush()
+        self.time_stamps.flush()
+        self.write_header()
+
+
+    def update_header(self, **entries):
+        # =================================================================
+        # Add or replace header entries from any thread. The writer thread
+        # applies them at its next header write: self.header is only
+        # changed by the thread that dumps it. The dict of updates is
+        # replaced, never changed in place, so reading it is safe
+        # =================================================================
+        self.header_updates = dict(self.header_updates, **entries)
+
+
+    def write_header(self):
+
+        self.header.update(self.header_updates)
+        self.header['num_samples']  = self.num_samples
+        self.header['overflows']    = self.overflows
+        temp_name           = os.path.join(self.session_dir, 'header.json.tmp')
+        with open(temp_name, 'w') as header_file:
+            json.dump(self.header, header_file, indent=4)
+        os.replace(temp_name, os.path.join(self.session_dir, 'header.json'))
+
+
+    def stop(self):
+        # =================================================================
+        # Write remaining samples, finalize header and close files
+        # =================================================================
+        if self.writer is None:
+            return
+        self.pending.put(None)
+        self.writer.join()
+        self.writer         = None
+        del self.samples, self.time_stamps
+        self.samples_file.close()
+        self.stamps_file.close()
+
+
+def load_session(session_dir):
+    # =================================================================
+    # Input:
+    #   session_dir         Directory written by SessionRecorder
+    # Output:
+    #   samples             Memory-mapped view [channels x samples]
+    #                       (float32, nothing is read until accessed)
+    #   time_stamps         Memory-mapped view [samples] (ms)
+    #   header              Dict of session information
+    # =================================================================
+    with open(os.path.join(session_dir, 'header.json')) as header_file:
+        header          = json.load(header_file)
+    num_samples         = header['num_samples']
+    num_channels        = len(header['channel_names'])
+
+    if num_samples == 0:
+        return np.zeros((num_channels, 0), np.float32), np.zeros(0), header
+
+    samples             = np.memmap(os.path.join(session_dir, 'samples.f32'),
+        np.float32, 'r', shape=(num_samples, num_channels))
+    time_stamps         = np.memmap(os.path.join(session_dir, 'time_stamps.f64'),
+        np.float64, 'r', shape=(num_samples,))
+    return samples.T, time_stamps, header
@@ -0,0 +1,173 @@
+import numpy as np
+from multiprocessing                import shared_memory
+
+
+class RingBuffer():
+
+    def __init__(self, num_channels, capacity, dtype=np.float64):
+        # =================================================================
+        # Fixed-capacity circular buffer for samples and their time stamps
+        # -----------------------------------------------------------------
+        # - Storage is allocated once and held twice back to back: every
+        #   sample is written at write_idx and at write_idx + capacity
+        # - Therefore the newest samples are always one contiguous slice
+        #   and can be handed out as a view without copying
+        # - The write index is derived from total_written, which is the
+        #   only counter that changes and is updated after the data
+        # =================================================================
+        self.num_channels   = int(num_channels)
+        self.capacity       = int(capacity)
+        self.dtype          = np.dtype(dtype)
+        self.data           = np.zeros((self.num_channels, 2 * self.capacity), self.dtype)
+        self.time_stamps    = np.zeros(2 * self.capacity)
+        self.total_written  = 0 # Samples appended since creation
+
+
+    @property
+    def write_idx(self):
+        # Position of the next sample in [0, capacity)
+        return self.total_written % self.capacity
+
+
+    def append(self, sample, time_stamp):
+        # =================================================================
+        # Input:
+        #   sample              Numpy 1D array [channels]
+        #   time_stamp          Scalar time stamp of the sample
+        # =================================================================
+        idx                         = self.write_idx
+        self.data[:, idx]           = sample
+        self.data[:, idx + self.capacity] = sample
+        self.time_stamps[idx]       = time_stamp
+        self.time_stamps[idx + self.capacity] = time_stamp
+
+        self.total_written          = self.total_written + 1
+
+
+    def extend(self, samples, time_stamps):
+        # =================================================================
+        # Input:
+        #   samples             Numpy array [channels x samples]
+        #   time_stamps         Numpy 1D array [samples]
+        # =================================================================
+        num_new             = samples.shape[1]
+        if num_new == 0:
+            return
+        skipped             = 0
+        if num_new > self.capacity:
+            # Older samples would be overwritten in the same call anyway
+            skipped         = num_new - self.capacity
+            samples         = samples[:, -self.capacity:]
+            time_stamps     = time_stamps[-self.capacity:]
+            num_new         = self.capacity
+
+        # Write in at most two contiguous segments per storage half
+        idx                 = (self.total_written + skipped) % self.capacity
+        first               = min(num_new, self.capacity - idx)
+        for offset in (0, self.capacity):
+            start           = idx + offset
+            self.data[:, start:start + first]       = samples[:, :first]
+            self.time_stamps[start:start + first]   = time_stamps[:first]
+            self.data[:, offset:offset + num_new - first]     = samples[:, first:]
+            self.time_stamps[offset:offset + num_new - first] = time_stamps[first:]
+
+        self.total_written  = self.total_written + skipped + num_new
+
+
+    def latest(self, num_samples=None, total_written=None):
+        # =================================================================
+        # Input:
+        #   num_samples         Number of newest samples (default: all)
+        #   total_written       Counter value to read at (default: now)
+        # Output:
+        #   data                View [channels x num_samples], oldest first
+        #   time_stamps         View [num_samples]
+        # -----------------------------------------------------------------
+        # Views share memory with the buffer and change with later
+        # appends: copy them if they must outlive the next sample
+        # =================================================================
+        if num_samples is None:
+            num_samples     = self.capacity
+        if total_written is None:
+            total_written   = self.total_written
+        num_samples         = min(int(num_samples), self.capacity)
+        end                 = total_written % self.capacity + self.capacity
+        start               = end - num_samples
+        return self.data[:, start:end], self.time_stamps[start:end]
+
+
+    def reset(self):
+        self.data[:]        = 0
+        self.time_stamps[:] = 0
+        self.total_written  = 0
+
+
+class SharedRingBuffer(RingBuffer):
+
+    def __init__(self, num_channels, capacity, dtype=np.float64, name=None):
+        # =================================================================
+        # Ring buffer living in multiprocessing.shared_memory
+        # -----------------------------------------------------------------
+        # - The sampling process writes in place, the frontend reads the
+        #   newest window as a view: nothing is pickled or sent
+        # - total_written doubles as sequence counter: it is stored in
+        #   the shared header and only advanced once a sample is written
+        # - Pass name to attach to an existing buffer, leave it None to
+        #   create (and own) a new one
+        # =================================================================
+        self.num_channels   = int(num_channels)
+        self.capacity       = int(capacity)
+        self.dtype          = np.dtype(dtype)
+        self.owner          = name is None
+
+        header_bytes        = np.dtype(np.int64).itemsize
+        data_bytes          = self.num_channels * 2 * self.capacity * self.dtype.itemsize
+        stamp_bytes         = 2 * self.capacity * np.dtype(np.float64).itemsize
+
+        if self.owner:
+            self.shm        = shared_memory.SharedMemory(create=True,
+                size=header_bytes + data_bytes + stamp_bytes)
+        else:
+            self.shm        = shared_memory.SharedMemory(name=name)
+
+        self.header         = np.ndarray((1,), np.int64, self.shm.buf, 0)
+        self.data           = np.ndarray((self.num_channels, 2 * self.capacity),
+            self.dtype, self.shm.buf, header_bytes)
+        self.time_stamps    = np.ndarray((2 * self.capacity,), np.float64,
+            self.shm.buf, header_bytes + data_bytes)
+
+        if self.owner:
+            self.reset()
+
+
+    @property
+    def total_written(self):
+        return int(self.header[0])
+
+
+    @total_written.setter
+    def total_written(self, value):
+        self.header[0]      = value
+
+
+    def __getstate__(self):
+        # Child processes attach to the same memory instead of a copy
+        return (self.num_channels, self.capacity, self.dtype.str, self.shm.name)
+
+
+    def __setstate__(self, state):
+        num_channels, capacity, dtype, name = state
+        self.__init__(num_channels, capacity, dtype, name)
+
+
+    def close(self):
+        # =================================================================
+        # Release the mapping in this process, the creator also removes
+        # the shared memory block itself
+        # =================================================================
+        self.header         = None
+        self.data           = None
+        self.time_stamps    = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
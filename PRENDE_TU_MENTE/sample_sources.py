@@ -0,0 +1,234 @@
+import time
+import socket
+import numpy as np
+from wire_format                    import decode_packet, sequence_gap, MAX_PACKET_SIZE
+from recorder                       import load_session
+
+
+# =====================================================================
+# Sample sources for Backend.fill_buffer
+# ---------------------------------------------------------------------
+# Every source provides
+#   start()     Prepare streaming (called in the sampling process)
+#   read()      Numpy array [channels x samples] of new samples, or None
+#               if nothing arrived in time (the caller just asks again)
+#   close()     Release resources
+#   finished    True once a finite source is exhausted
+# =====================================================================
+
+
+class UdpSource():
+
+    def __init__(self, conn_socket, num_channels, warm_up_packets=500,
+        warm_up_time=0.2, timeout=0.5):
+        # =================================================================
+        # Neuri GUI (JSON) or binary packets received on a bound UDP
+        # socket, see wire_format.py
+        # =================================================================
+        self.conn_socket    = conn_socket
+        self.num_channels   = num_channels
+        self.warm_up_packets= warm_up_packets
+        self.warm_up_time   = warm_up_time # s, at most spent discarding
+        self.timeout        = timeout # s, wake up to let caller check stop
+        self.finished       = False
+
+        # Receive datagrams into one preallocated buffer
+        self.recv_buffer    = bytearray(MAX_PACKET_SIZE)
+        self.last_sequence  = None
+        self.lost_packets   = 0 # From gaps in the sequence of binary packets
+        self.skipped        = 0 # Packets that could not be decoded
+
+
+    def start(self):
+
+        # Discard up to warm_up_packets queued before we were ready,
+        # without waiting for packets that are not there (yet), and for
+        # warm_up_time at most: a sender faster than we discard must not
+        # keep us from starting
+        self.conn_socket.setblocking(False)
+        t_end               = time.perf_counter() + self.warm_up_time
+        for _ in range(self.warm_up_packets):
+            try:
+                self.conn_socket.recv_into(self.recv_buffer)
+            except BlockingIOError:
+                break
+            if time.perf_counter() > t_end:
+                break
+        self.conn_socket.settimeout(self.timeout)
+
+
+    def read(self):
+        # =================================================================
+        # Output:
+        #   eeg_data            Numpy array [channels x samples], one or
+        #                       many samples depending on packet format.
+        #                       Binary packets are decoded as a view into
+        #                       self.recv_buffer: consume before next call
+        # =================================================================
+        try:
+            num_bytes       = self.conn_socket.recv_into(self.recv_buffer)
+        except socket.timeout:
+            return None
+        eeg_data, sequence  = decode_packet(self.recv_buffer, num_bytes, self.num_channels)
+
+        if eeg_data is None:
+            self.skipped    = self.skipped + 1
+            return None
+
+        if sequence is not None:
+            gap             = sequence_gap(self.last_sequence, sequence)
+            if gap < 0:
+                return None # Late duplicate or reordered packet
+            self.lost_packets   = self.lost_packets + gap
+            self.last_sequence  = sequence
+        return eeg_data
+
+
+    def close(self):
+        self.conn_socket.close()
+
+
+class PacedSource():
+
+    def __init__(self, sample_rate, real_time=True, chunk_size=None, num_samples=None):
+        # =================================================================
+        # Base of sources that produce samples themselves: in real time
+        # read() returns the samples due since last call (like a board
+        # would), otherwise chunk_size samples per call as fast as
+        # possible. The source is finished after num_samples (None:
+        # endless)
+        # =================================================================
+        self.sample_rate    = sample_rate
+        self.real_time      = real_time
+        self.chunk_size     = int(chunk_size or sample_rate)
+        self.num_samples    = num_samples
+        self.num_read       = 0
+        self.finished       = False
+
+
+    def start(self):
+        self.t_start        = time.perf_counter()
+
+
+    def read(self):
+
+        if self.real_time:
+            elapsed         = time.perf_counter() - self.t_start
+            num_due         = int(elapsed * self.sample_rate) - self.num_read
+            if num_due <= 0:
+                time.sleep((self.num_read + 1) / self.sample_rate - elapsed)
+                return None
+            num_due         = min(num_due, self.chunk_size)
+        else:
+            num_due         = self.chunk_size
+        if self.num_samples is not None:
+            num_due         = min(num_due, self.num_samples - self.num_read)
+
+        samples             = self.generate(num_due)
+        self.num_read       = self.num_read + num_due
+        self.finished       = self.num_read == self.num_samples
+        return samples
+
+
+    def close(self):
+        pass
+
+
+class ReplaySource(PacedSource):
+
+    def __init__(self, session_dir, real_time=True, chunk_size=None):
+        # =================================================================
+        # Replay a session written by recorder.py (memory-mapped, nothing
+        # is loaded up front)
+        # =================================================================
+        self.session_dir    = session_dir
+        self.recording, self.time_stamps, self.header = load_session(session_dir)
+        PacedSource.__init__(self, self.header['sample_rate'], real_time,
+            chunk_size, self.recording.shape[1])
+
+
+    def generate(self, num_samples):
+        return self.recording[:, self.num_read:self.num_read + num_samples]
+
+
+    def __getstate__(self):
+        # Child processes map the session again instead of receiving a
+        # pickled copy of all samples (spawn start method)
+        return (self.session_dir, self.real_time, self.chunk_size)
+
+
+    def __setstate__(self, state):
+        session_dir, real_time, chunk_size = state
+        self.__init__(session_dir, real_time, chunk_size)
+
+
+class SyntheticSource(PacedSource):
+
+    def __init__(self, num_channels, sample_rate, real_time=True, chunk_size=None,
+        duration=None, ecg_channels=(0,), heart_rate=72, line_noise=50, seed=0):
+        # =================================================================
+        # Generated test signal (uV): ECG on ecg_channels, EEG-like
+        # background (low-pass noise plus alpha rhythm) on all others,
+        # with baseline wander, line noise and white noise everywhere.
+        # duration (s) makes the source finite
+        # =================================================================
+        num_samples         = None if duration is None else int(duration * sample_rate)
+        PacedSource.__init__(self, sample_rate, real_time, chunk_size, num_samples)
+        self.num_channels   = num_channels
+        self.ecg_channels   = [iChan for iChan in ecg_channels if iChan < num_channels]
+        self.heart_rate     = heart_rate # bpm
+        self.line_noise     = line_noise # Hz
+        self.random         = np.random.default_rng(seed)
+
+        # Beat times (s) covering the samples generated so far
+        self.beat_times     = [0.5]
+
+
+    def start(self):
+
+        # Low-pass filter state keeps the EEG background continuous
+        import scipy.signal
+        self.eeg_sos        = scipy.signal.butter(2, min(30, 0.45 * self.sample_rate),
+            fs=self.sample_rate, output='sos')
+        self.eeg_zi         = np.zeros((self.eeg_sos.shape[0], self.num_channels, 2))
+        PacedSource.start(self)
+
+
+    def ecg(self, t):
+
+        # Add beats up to shortly after the chunk, with some variability
+        while self.beat_times[-1] < t[-1] + 1:
+            period          = 60 / self.heart_rate * (1 + 0.05 * self.random.standard_normal())
+            self.beat_times.append(self.beat_times[-1] + period)
+
+        # P, Q, R, S and T waves: (amplitude uV, offset s, width s)
+        waves               = ((150, -0.2, 0.025), (-200, -0.03, 0.01),
+            (1500, 0, 0.01), (-350, 0.03, 0.01), (400, 0.25, 0.04))
+        signal              = np.zeros(t.shape[0])
+        for beat_time in self.beat_times:
+            if beat_time < t[0] - 1 or beat_time > t[-1] + 1:
+                continue
+            for amplitude, offset, width in waves:
+                signal      = signal + amplitude * np.exp(-((t - beat_time - offset) / width) ** 2)
+        self.beat_times     = [beat_time for beat_time in self.beat_times if beat_time >= t[-1] - 1]
+        return signal
+
+
+    def generate(self, num_samples):
+
+        t                   = (self.num_read + np.arange(num_samples)) / self.sample_rate
+
+        # EEG background on all channels
+        import scipy.signal
+        noise               = 60 * self.random.standard_normal((self.num_channels, num_samples))
+        samples, self.eeg_zi= scipy.signal.sosfilt(self.eeg_sos, noise, axis=1, zi=self.eeg_zi)
+        samples             = samples + 10 * np.sin(2 * np.pi * 10 * t)
+
+        if self.ecg_channels:
+            samples[self.ecg_channels] = self.ecg(t)
+
+        # Artefacts on every channel
+        samples             = samples + 100 * np.sin(2 * np.pi * 0.2 * t) + \
+            20 * np.sin(2 * np.pi * self.line_noise * t) + \
+            5 * self.random.standard_normal((self.num_channels, num_samples))
+        return samples
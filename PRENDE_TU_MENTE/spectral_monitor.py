@@ -0,0 +1,192 @@
+import numpy as np
+from numpy.lib.stride_tricks        import sliding_window_view
+
+
+# Frequency bands of the band powers (Hz), lower edge included
+FREQUENCY_BANDS = {
+    'Delta':    (0.5, 4),
+    'Theta':    (4, 8),
+    'Alpha':    (8, 13),
+    'Beta':     (13, 30),
+    'Gamma':    (30, 45)}
+
+
+class SpectralMonitor():
+
+    def __init__(self, num_channels, sample_rate, line_noise=50,
+        bands=FREQUENCY_BANDS, segment_length=1, num_segments=8, overlap=0.5,
+        flat_threshold=1, saturation_level=None):
+        # =================================================================
+        # Running Welch power spectral density of the raw stream, with
+        # band powers and a signal quality index per channel
+        # -----------------------------------------------------------------
+        # - New samples are cut into Hann windowed segments of
+        #   segment_length s overlapping by overlap. Each complete segment
+        #   adds its periodogram to a running sum over the last
+        #   num_segments: the PSD is the Welch estimate of the latest
+        #   segments, one FFT per new segment instead of a recomputation
+        #   over the window
+        # - Quality from the newest segment and the PSD:
+        #     line_noise_ratio  Share of the power (above 0.5 Hz) within
+        #                       2 Hz of the line noise and its harmonics
+        #     flat              Peak-to-peak below flat_threshold (uV):
+        #                       electrode off or amplifier not streaming
+        #     saturated         Above 1% of the samples at the rails:
+        #                       beyond saturation_level (uV) if given,
+        #                       else repeating the segment extremes (a
+        #                       clipped signal sits on the same value)
+        #     score             0 if flat or saturated, else 1 - line
+        #                       noise ratio
+        # =================================================================
+        self.num_channels   = num_channels
+        self.sample_rate    = sample_rate
+        self.line_noise     = line_noise # Hz, switched with the notch
+        self.bands          = dict(bands)
+        self.num_segments   = num_segments
+        self.flat_threshold = flat_threshold
+        self.saturation_level = saturation_level
+
+        self.segment        = int(segment_length * sample_rate)
+        self.hop            = max(1, int(round(self.segment * (1 - overlap))))
+        self.window         = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(self.segment) / self.segment)
+        self.frequencies    = np.fft.rfftfreq(self.segment, 1 / sample_rate)
+
+        # Density scaling of scipy.signal.welch, one-sided
+        self.scaling        = np.full(self.frequencies.shape[0],
+            2 / (sample_rate * np.sum(self.window ** 2)))
+        self.scaling[0]     = self.scaling[0] / 2
+        if self.segment % 2 == 0:
+            self.scaling[-1]= self.scaling[-1] / 2
+        self.reset()
+
+
+    def reset(self):
+
+        self.periodograms   = np.zeros((self.num_segments, self.num_channels,
+            self.frequencies.shape[0]))
+        self.total          = np.zeros((self.num_channels, self.frequencies.shape[0]))
+        self.num_averaged   = 0
+        self.next_slot      = 0
+        self.tail           = np.zeros((self.num_channels, 0)) # Start of next segment
+        self.newest         = None # Newest complete segment (raw)
+
+
+    def process(self, samples):
+        # =================================================================
+        # Input:
+        #   samples             Numpy array [channels x samples], the
+        #                       samples following the ones of last call
+        # Output:
+        #   num_new             Number of segments completed
+        # =================================================================
+        extended            = np.concatenate((self.tail, samples), axis=1)
+
+        # Segments older than the average are not computed at all
+        excess              = extended.shape[1] - (self.num_segments * self.hop + self.segment)
+        if excess > 0:
+            extended        = extended[:, excess - excess % self.hop:]
+
+        num_new             = max(0, (extended.shape[1] - self.segment) // self.hop + 1)
+        if num_new == 0:
+            self.tail       = extended
+            return 0
+        segments            = sliding_window_view(extended, self.segment, axis=1)[:, ::self.hop][:, :num_new]
+        self.newest         = segments[:, -1].copy()
+        self.tail           = extended[:, num_new * self.hop:]
+
+        detrended           = segments - segments.mean(axis=-1, keepdims=True)
+        spectra             = np.fft.rfft(detrended * self.window, axis=-1)
+        periodograms        = (spectra.real ** 2 + spectra.imag ** 2) * self.scaling
+
+        for iSegment in range(num_new):
+            slot            = self.next_slot
+            self.total      = self.total - self.periodograms[slot] + periodograms[:, iSegment]
+            self.periodograms[slot] = periodograms[:, iSegment]
+            self.next_slot  = (slot + 1) % self.num_segments
+        self.num_averaged   = min(self.num_averaged + num_new, self.num_segments)
+        return num_new
+
+
+    @property
+    def psd(self):
+        # Numpy array [channels x frequencies] (uV^2/Hz), see frequencies
+        return np.maximum(self.total, 0) / max(self.num_averaged, 1)
+
+
+    def band_powers(self):
+        # =================================================================
+        # Output:
+        #   powers              Numpy array [channels x bands] (uV^2) in
+        #                       order of self.bands
+        # =================================================================
+        psd                 = self.psd
+        resolution          = self.frequencies[1]
+        return np.stack([psd[:, (self.frequencies >= low) & (self.frequencies < high)].sum(axis=1)
+            * resolution for low, high in self.bands.values()], axis=1)
+
+
+    def quality(self):
+        # =================================================================
+        # Output:
+        #   quality             Dict of numpy arrays [channels]:
+        #                       line_noise_ratio, flat, saturated, score,
+        #                       and dominant (name of the strongest band)
+        # =================================================================
+        psd                 = self.psd
+        measured            = self.frequencies >= 0.5
+        line                = np.zeros(self.frequencies.shape[0], dtype=bool)
+        for harmonic in np.arange(self.line_noise, self.sample_rate / 2, self.line_noise):
+            line            = line | (np.abs(self.frequencies - harmonic) <= 2)
+        total_power         = psd[:, measured].sum(axis=1)
+        line_noise_ratio    = psd[:, line & measured].sum(axis=1) / np.maximum(total_power, 1e-12)
+
+        flat                = np.zeros(self.num_channels, dtype=bool)
+        saturated           = np.zeros(self.num_channels, dtype=bool)
+        if self.newest is not None:
+            newest          = self.newest
+            flat            = np.ptp(newest, axis=1) < self.flat_threshold
+            if self.saturation_level is not None:
+                at_rails    = np.abs(newest) >= self.saturation_level
+            else:
+                at_rails    = (newest == newest.max(axis=1, keepdims=True)) | \
+                    (newest == newest.min(axis=1, keepdims=True))
+            saturated       = ~flat & (at_rails.mean(axis=1) > 0.01) & \
+                (at_rails.sum(axis=1) > 2)
+
+        score               = np.where(flat | saturated, 0.0, 1 - line_noise_ratio)
+        band_names          = list(self.bands)
+        dominant            = np.array([band_names[iBand] for iBand
+            in self.band_powers().argmax(axis=1)])
+        return {
+            'line_noise_ratio': line_noise_ratio,
+            'flat':             flat,
+            'saturated':        saturated,
+            'score':            score,
+            'dominant':         dominant}
+
+
+    def report(self, channels=None):
+        # Quality, dominant band and band powers (uV^2) of each channel
+        # (default: all) for display, two lines per channel, channels
+        # named c1, c2, ... as the Neuri GUI does
+        quality             = self.quality()
+        powers              = self.band_powers()
+        if channels is None:
+            channels        = range(self.num_channels)
+        lines               = []
+        for iChan in channels:
+            name            = 'c' + str(iChan + 1)
+            if quality['flat'][iChan]:
+                state       = 'flat'
+            elif quality['saturated'][iChan]:
+                state       = 'saturated'
+            elif quality['line_noise_ratio'][iChan] > 0.5:
+                state       = 'line noise'
+            else:
+                state       = 'ok'
+            lines.append('{}: quality {:.2f} ({}), line noise {:.0f} %, {}'.format(name,
+                quality['score'][iChan], state, 100 * quality['line_noise_ratio'][iChan],
+                quality['dominant'][iChan]))
+            lines.append(' ' * (len(name) + 2) + '  '.join('{} {:.3g}'.format(band, power)
+                for band, power in zip(self.bands, powers[iChan])) + ' uV^2')
+        return '\n'.join(lines)
@@ -0,0 +1,204 @@
+import time
+import queue
+import numpy as np
+from multiprocessing                import RawValue, Event
+from threading                      import Thread
+from digital_signal_processing      import Processing
+from metrics                        import MetricsRegistry
+
+
+class TriggerControl():
+
+    def __init__(self, config, shared_buffer, shared_beats, start_time, metrics=None):
+        # =================================================================
+        # Low-latency trigger loop, meant to run in its own process
+        # -----------------------------------------------------------------
+        # - Reads new samples (amplitude mode) or beats (beats mode) from
+        #   the shared ring buffers of the sampling process and evaluates
+        #   the trigger for every sample, independent of plotting
+        # - Only edges are queued (bounded) for a writer thread that
+        #   keeps the serial port open and reuses it
+        # - Trigger state is published in self.trigger_state for display
+        # - Latency from sample arrival to serial write is recorded and
+        #   reported on stop, and published with the edge queue state in
+        #   metrics (registry shared with the other processes). In beats
+        #   mode also from the R-peak, which includes the detection delay
+        # =================================================================
+        self.config         = config
+        self.shared_buffer  = shared_buffer
+        self.shared_beats   = shared_beats
+        self.start_time     = start_time # ms, perf_counter clock of backend
+        self.metrics        = metrics if metrics is not None else MetricsRegistry()
+
+        self.threshold      = RawValue('d', 0.9 * 2500) # Amplitude mode
+        self.trigger_state  = RawValue('b', 0)
+        self.line_noise     = RawValue('d', config.line_noise) # Hz, set by GUI
+        self.stop_event     = Event()
+
+        self.queue_size     = 16
+        self.max_latencies  = 100000
+
+
+    def create_forward_port(self):
+
+        import serial #Crucial: Install using pip3 install "pyserial", NOT "serial"
+        self.sendser                = serial.Serial()
+        self.sendser.port           = self.config.serial_port
+        self.sendser.baudrate       = self.config.baud_rate
+        self.sendser.timeout        = None
+        self.sendser.write_timeout  = None
+        self.sendser.open()
+
+
+    def close_forward_port(self):
+
+        self.sendser.close()
+
+
+    def run(self):
+        # =================================================================
+        # Control loop: poll the shared buffers, push trigger edges
+        # =================================================================
+        self.edges          = queue.Queue(maxsize=self.queue_size)
+        self.latencies      = np.zeros(self.max_latencies)
+        self.num_latencies  = 0
+        self.overflows      = 0
+        self.queue_depth    = self.metrics.gauge('edge_queue_depth')
+        self.edges_dropped  = self.metrics.gauge('edges_dropped')
+        self.latency_timer  = self.metrics.timer('trigger_latency_ms')
+        self.beat_latencies = np.zeros(self.max_latencies)
+        self.num_beat_latencies = 0
+        self.beat_latency_timer = self.metrics.timer('beat_latency_ms')
+
+        self.sendser        = None
+        if self.config.serial_port is not None:
+            self.create_forward_port()
+        writer              = Thread(target=self.write_edges,
+            name='serial_writer', daemon=True)
+        writer.start()
+
+        if self.config.trigger_mode == 'amplitude':
+            dsp             = Processing(self.config)
+            stream_filter   = dsp.filter_bank.stream_filter()
+            line_noise      = self.line_noise.value
+            source          = self.shared_buffer
+        else:
+            source          = self.shared_beats
+        last_written        = source.total_written
+        last_beat_end       = None
+        trigger             = False
+
+        while not self.stop_event.is_set():
+
+            total_written   = source.total_written
+            num_new         = min(total_written - last_written, source.capacity)
+            last_written    = total_written
+
+            if self.config.trigger_mode == 'amplitude':
+                if self.line_noise.value != line_noise:
+                    line_noise  = self.line_noise.value
+                    dsp.filter_bank.set_line_noise(line_noise)
+                    dsp.filter_bank.update(stream_filter)
+                if num_new > 0:
+                    samples, stamps = source.latest(num_new, total_written=total_written)
+                    filtered    = stream_filter.process(
+                        samples[self.config.target_channel:self.config.target_channel+1])
+                    states      = abs(filtered[0]) >= self.threshold.value
+                    for iEdge in np.flatnonzero(states != np.concatenate(([trigger], states[:-1]))):
+                        trigger = bool(states[iEdge])
+                        self.push_edge(trigger, self.start_time + stamps[iEdge])
+            else:
+                # Trigger stays on for trigger_duration after each beat,
+                # arrival is that of the sample which confirmed the beat,
+                # the event the R-peak
+                if num_new > 0:
+                    beats, beat_times = source.latest(num_new, total_written=total_written)
+                    last_beat_end   = self.start_time + beat_times[-1] + \
+                        self.config.trigger_duration * 1000
+                    if not trigger:
+                        trigger     = True
+                        self.push_edge(trigger, self.start_time + beat_times[-1] + beats[1, -1],
+                            self.start_time + beat_times[-1])
+                if trigger and time.perf_counter() * 1000 >= last_beat_end:
+                    trigger         = False
+                    self.push_edge(trigger, last_beat_end)
+
+            time.sleep(self.config.control_interval)
+
+        self.edges.put(None)
+        writer.join(timeout=1)
+        if self.sendser is not None:
+            self.close_forward_port()
+        print(self.latency_report())
+
+
+    def push_edge(self, trigger, arrival_time, event_time=None):
+        # =================================================================
+        # Input:
+        #   trigger             New trigger state
+        #   arrival_time        Time the causing sample arrived (ms,
+        #                       perf_counter clock)
+        #   event_time          Time of the detected event (R-peak), if
+        #                       any (ms, perf_counter clock)
+        # =================================================================
+        self.trigger_state.value = trigger
+        try:
+            self.edges.put_nowait((trigger, arrival_time, event_time))
+        except queue.Full:
+            self.overflows  = self.overflows + 1
+            self.edges_dropped.set(self.overflows)
+        self.queue_depth.set(self.edges.qsize())
+
+
+    def write_edges(self):
+
+        while True:
+            edge            = self.edges.get()
+            if edge is None:
+                return
+            trigger, arrival_time, event_time = edge
+            if self.sendser is not None:
+                self.sendser.write(b"H" if trigger else b"L")
+            now             = time.perf_counter() * 1000
+            latency         = now - arrival_time
+            self.latency_timer.observe(latency)
+            self.queue_depth.set(self.edges.qsize())
+            if self.num_latencies < self.max_latencies:
+                self.latencies[self.num_latencies] = latency
+                self.num_latencies = self.num_latencies + 1
+            if event_time is not None:
+                self.beat_latency_timer.observe(now - event_time)
+                if self.num_beat_latencies < self.max_latencies:
+                    self.beat_latencies[self.num_beat_latencies] = now - event_time
+                    self.num_beat_latencies = self.num_beat_latencies + 1
+
+
+    def latency_report(self, num_bins=10):
+        # =================================================================
+        # Output:
+        #   report              Text with p50/p99 and a histogram of the
+        #                       sample arrival to serial write latency,
+        #                       and p50/p99 from the R-peak (beats mode)
+        # =================================================================
+        latencies           = self.latencies[:self.num_latencies]
+        target              = self.config.serial_port or 'no serial port'
+        if latencies.size == 0:
+            return 'Trigger latency ({}): no edges'.format(target)
+
+        report              = ['Trigger latency ({}): {} edges, {} dropped, '
+            'p50 {:.2f} ms, p99 {:.2f} ms'.format(target, latencies.size,
+            self.overflows, np.percentile(latencies, 50), np.percentile(latencies, 99))]
+        counts, edges       = np.histogram(latencies, bins=num_bins)
+        for iBin in range(num_bins):
+            report.append('  {:8.2f} - {:8.2f} ms {:>7d} {}'.format(edges[iBin],
+                edges[iBin + 1], counts[iBin], '#' * int(40 * counts[iBin] / counts.max())))
+        beat_latencies      = self.beat_latencies[:self.num_beat_latencies]
+        if beat_latencies.size > 0:
+            report.append('R-peak to serial write: {} beats, p50 {:.2f} ms, p99 {:.2f} ms'.format(
+                beat_latencies.size, np.percentile(beat_latencies, 50),
+                np.percentile(beat_latencies, 99)))
+        return '\n'.join(report)
+
+
+    def stop(self):
+        self.stop_event.set()
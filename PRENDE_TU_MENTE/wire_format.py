@@ -0,0 +1,86 @@
+import numpy as np
+import struct
+import json
+
+
+# =====================================================================
+# UDP packet formats understood by the receiver
+# ---------------------------------------------------------------------
+# JSON (Neuri GUI):   {"c1": <float>, "c2": <float>, ...}, one sample
+#                     per datagram, channels named c1 ... cN
+# Binary (batched):   12 byte little-endian header followed by float32
+#                     samples, interleaved per sample:
+#                       magic       4s  b'PTM1'
+#                       sequence    I   packet counter of the sender
+#                       channels    H   number of channels
+#                       samples     H   number of samples in packet
+#                       payload     f4  [samples x channels]
+# The format of every packet is detected from its first bytes
+# =====================================================================
+BINARY_MAGIC        = b'PTM1'
+BINARY_HEADER       = struct.Struct('<4sIHH')
+MAX_PACKET_SIZE     = 65507 # Largest UDP payload over IPv4
+
+
+def encode_binary_packet(samples, sequence):
+    # =================================================================
+    # Input:
+    #   samples             Numpy array [channels x samples]
+    #   sequence            Packet counter (wraps at 2**32)
+    # Output:
+    #   packet              Bytes ready for socket.sendto
+    # =================================================================
+    num_channels, num_samples = samples.shape
+    header          = BINARY_HEADER.pack(BINARY_MAGIC,
+        sequence % 2**32, num_channels, num_samples)
+    payload         = np.ascontiguousarray(samples.T, dtype='<f4')
+    return header + payload.tobytes()
+
+
+def decode_packet(packet, num_bytes, num_channels):
+    # =================================================================
+    # Input:
+    #   packet              bytes/bytearray/memoryview holding a datagram
+    #   num_bytes           Number of valid bytes in packet
+    #   num_channels        Number of channels expected by the receiver
+    # Output:
+    #   samples             Numpy array [channels x samples] (for binary
+    #                       packets a view into packet: consume before
+    #                       the next receive), None if invalid
+    #   sequence            Packet counter, None for JSON packets
+    # =================================================================
+    if num_bytes >= BINARY_HEADER.size and packet[:4] == BINARY_MAGIC:
+        _, sequence, channels, num_samples = BINARY_HEADER.unpack_from(packet)
+        if channels != num_channels or \
+            num_bytes < BINARY_HEADER.size + 4 * channels * num_samples:
+            return None, sequence
+        samples     = np.frombuffer(packet, dtype='<f4',
+            count=channels * num_samples, offset=BINARY_HEADER.size)
+        return samples.reshape(num_samples, channels).T, sequence
+
+    try:
+        eeg_dict    = json.loads(bytes(packet[:num_bytes]))
+        samples     = np.array([[float(eeg_dict["c" + str(iChan + 1)])]
+            for iChan in range(num_channels)])
+    except (ValueError, KeyError, TypeError):
+        return None, None
+    return samples, None
+
+
+def sequence_gap(last_sequence, sequence):
+    # =================================================================
+    # Input:
+    #   last_sequence       Sequence of the previous packet (None for the
+    #                       first one)
+    #   sequence            Sequence of the packet just received
+    # Output:
+    #   gap                 Number of packets lost in between (0 if
+    #                       consecutive), -1 if the packet is older than
+    #                       the previous one (reordered or duplicated)
+    # =================================================================
+    if last_sequence is None:
+        return 0
+    gap             = (sequence - last_sequence - 1) % 2**32
+    if gap >= 2**31:
+        return -1
+    return gap